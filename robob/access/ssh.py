@@ -61,6 +61,13 @@ class Pipe(PipeBase):
 		# Return new arguments
 		return args
 
+	def pipe_reset(self):
+		"""
+		Forget the authentication state of the previous run
+		"""
+		self.sent_line = ""
+		PipeBase.pipe_reset(self)
+
 	def expect_password(self, expect, match, line):
 		"""
 		Callback when a password prompt is encountered
@@ -29,6 +29,22 @@ class Aggregate(MetricAggregator):
 			return [ 0 ]
 		return [ float(num) / len(values) ]
 
+	def summarize(self, total):
+		"""
+		Calculate the average from the series totals
+		"""
+		if total.count == 0:
+			return [ 0 ]
+		return [ float(total.sum) / total.count ]
+
+	def collect_columns(self, t, v):
+		"""
+		Calculate the average of the column of numbers
+		"""
+		if len(v) == 0:
+			return [ 0 ]
+		return [ float(sum(v)) / len(v) ]
+
 	def titles(self):
 		"""
 		Return the titles of this aggregator values
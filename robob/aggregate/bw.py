@@ -106,6 +106,53 @@ class Aggregate(MetricAggregator):
 		# Return bandwidth suffixes
 		return [ v_avg, v_min, v_max ]
 
+	def collect_buckets(self, buckets):
+		"""
+		Approximate the bandwidth from the time-bucketed values
+		"""
+
+		# Min max and avereage
+		v_min = None
+		v_max = None
+		v_avg = 0
+		num = 0
+
+		# Iterate over buckets
+		last_b = None
+		for b in buckets:
+			if last_b is not None:
+
+				# Calculate time difference (sec)
+				time_diff = b.t - last_b.t
+
+				# Calculate transferred bytes within the bucket
+				if self.mode == MODE_INCREMENTING:
+					bw_diff = b.max - last_b.max
+				elif self.mode == MODE_PARTIAL:
+					bw_diff = b.sum
+				elif self.mode == MODE_OPERATIONS:
+					bw_diff = b.sum * self.opsize
+
+				# Calculate bandwidth (bytes/sec)
+				bw = bw_diff / time_diff
+
+				# Update
+				if v_min is None or bw < v_min:
+					v_min = bw
+				if v_max is None or bw > v_max:
+					v_max = bw
+				v_avg += bw
+				num += 1
+
+			last_b = b
+
+		# Average
+		if num:
+			v_avg /= num
+
+		# Return bandwidth suffixes
+		return [ v_avg, v_min, v_max ]
+
 	def titles(self):
 		"""
 		Return the titles of this aggregator values
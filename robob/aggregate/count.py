@@ -22,6 +22,18 @@ class Aggregate(MetricAggregator):
 		# Return numer of values in the timeseries
 		return [ len(values) ]
 
+	def summarize(self, total):
+		"""
+		The number of values is kept in the series totals
+		"""
+		return [ total.count ]
+
+	def collect_columns(self, t, v):
+		"""
+		The number of values is the length of the columns
+		"""
+		return [ len(v) ]
+
 	def titles(self):
 		"""
 		Return the titles of this aggregator values
@@ -31,6 +31,20 @@ class Aggregate(MetricAggregator):
 		# Return maximum
 		return [ num ]
 
+	def summarize(self, total):
+		"""
+		The maximum is kept in the series totals
+		"""
+		return [ total.max ]
+
+	def collect_columns(self, t, v):
+		"""
+		Calculate the maximum of the column of numbers
+		"""
+		if len(v) == 0:
+			return [ None ]
+		return [ max(v) ]
+
 	def titles(self):
 		"""
 		Return the titles of this aggregator values
@@ -31,6 +31,20 @@ class Aggregate(MetricAggregator):
 		# Return minimum
 		return [ num ]
 
+	def summarize(self, total):
+		"""
+		The minimum is kept in the series totals
+		"""
+		return [ total.min ]
+
+	def collect_columns(self, t, v):
+		"""
+		Calculate the minimum of the column of numbers
+		"""
+		if len(v) == 0:
+			return [ None ]
+		return [ min(v) ]
+
 	def titles(self):
 		"""
 		Return the titles of this aggregator values
@@ -27,6 +27,18 @@ class Aggregate(MetricAggregator):
 		# Return sum
 		return [ num ]
 
+	def summarize(self, total):
+		"""
+		The sum is kept in the series totals
+		"""
+		return [ total.sum ]
+
+	def collect_columns(self, t, v):
+		"""
+		Calculate the sum of the column of numbers
+		"""
+		return [ sum(v) ]
+
 	def titles(self):
 		"""
 		Return the titles of this aggregator values
@@ -0,0 +1,201 @@
+
+import os
+import json
+import hashlib
+import logging
+import datetime
+
+from robob.stream import streamContext
+
+class ResultCache(object):
+	"""
+	A local cache of test results, addressed by a hash of the rendered
+	stream contexts of the test-case, the parsers and streamlets of the
+	streams and the specs of the metrics.
+
+	  cache:
+	    path: ./cache                 # Where to keep the results
+	    files: [ "${app.binary}" ]    # Local files whose checksum busts the cache
+	    values: [ "${version}" ]      # Other values that bust the cache
+
+	"""
+
+	def __init__(self, specs, config):
+		"""
+		Initialize the cache from the 'cache' specs
+		"""
+		self.specs = specs
+		self.path = "./cache"
+		self.logger = logging.getLogger("cache")
+
+		# Checksums of the files, by (path, size, mtime)
+		self.checksums = {}
+
+		# Update optional
+		if isinstance(config, dict) and ('path' in config):
+			self.path = config['path']
+
+		# Make directory
+		if not os.path.exists(self.path):
+			os.makedirs(self.path)
+		elif not os.path.isdir(self.path):
+			raise AssertionError("Cache %s is not directory!" % self.path)
+
+	def checksum(self, filename):
+		"""
+		Calculate the checksum of the given file
+		"""
+
+		# Use the last checksum if the file was not modified
+		if not os.path.isfile(filename):
+			raise AssertionError("Cache file %s was not found on this machine!" % filename)
+		st = os.stat(filename)
+		fkey = (filename, st.st_size, st.st_mtime)
+		if fkey in self.checksums:
+			return self.checksums[fkey]
+
+		# Hash contents
+		h = hashlib.sha1()
+		with open(filename, "rb") as f:
+			while True:
+				buf = f.read(65536)
+				if not buf:
+					break
+				h.update(buf)
+
+		# Keep and return
+		self.checksums[fkey] = h.hexdigest()
+		return self.checksums[fkey]
+
+	def key(self, testContext):
+		"""
+		Calculate the key of the given test context
+		"""
+		inputs = []
+		temp = {}
+
+		# Collect the rendered stream contexts
+		for specs in self.specs.specs['streams']:
+			ctx = streamContext( testContext, specs )
+			stream = {}
+			for k in ['stream', 'node', 'app', 'env']:
+				if k in ctx:
+					stream[k] = ctx[k]
+
+			# Collect the user-defined values that bust the cache,
+			# rendered in the context of the stream
+			if 'cache.values' in ctx:
+				stream['values'] = ctx['cache.values']
+			if 'cache.files' in ctx:
+				files = ctx['cache.files']
+				if isinstance(files, str):
+					files = [ files ]
+				stream['files'] = [ self.checksum(f) for f in files ]
+
+			# Collect the parsers and the streamlets, that decide
+			# which values are extracted from the output
+			stream['parsers'] = self.parsers( ctx, specs )
+			stream['streamlets'] = self.streamlets( specs )
+			inputs.append( stream )
+
+			# Temporary file paths are random, so keep them
+			# to replace them with their names
+			if 'app.files' in ctx:
+				for f in ctx['app.files']:
+					if f['temp']:
+						temp[f['path']] = "${app.files.%s.path}" % f['name']
+
+		# Collect the test values, the metric columns and the specs
+		# of the metrics, that decide how the values are formatted
+		inputs.append( testContext['curr'] )
+		inputs.append( self.specs.getMetricTitles() )
+		inputs.append( self.specs.specs.get('metrics', []) )
+
+		# Serialize and hash
+		buf = json.dumps( inputs, sort_keys=True, default=str )
+		for k, v in temp.items():
+			buf = buf.replace( k, v )
+		return hashlib.sha1( buf.encode("utf-8") ).hexdigest()
+
+	def streamlets(self, specs):
+		"""
+		Return the definitions of the streamlets of the given stream specs
+		"""
+		definitions = dict([ (str(s['name']), s) for s in self.specs.specs.get('streamlets', []) ])
+		ans = []
+		for slt in specs.get('streamlets', []):
+			if isinstance(slt, str):
+				slt = { "name": slt }
+			ans.append( (slt, definitions.get( str(slt.get('name', None)), None )) )
+		return ans
+
+	def parsers(self, ctx, specs):
+		"""
+		Return the definitions of the parsers of the app and the
+		streamlets of the given stream context and specs
+		"""
+		names = []
+		if 'app.parser' in ctx:
+			names.append( ctx['app.parser'] )
+		elif 'app.parsers' in ctx:
+			names += ctx['app.parsers']
+		for slt, streamlet in self.streamlets( specs ):
+			for d in [ streamlet or {}, slt ]:
+				if 'parser' in d:
+					names.append( d['parser'] )
+				if 'parsers' in d:
+					names += d['parsers']
+
+		# Collect definitions
+		ans = []
+		for n in names:
+			if "parser.%s" % n in ctx:
+				ans.append( ctx["parser.%s" % n] )
+			else:
+				ans.append( n )
+		return ans
+
+	def filename(self, key):
+		"""
+		Return the filename of the cache entry with the given key
+		"""
+		return "%s/%s.json" % (self.path, key)
+
+	def load(self, key):
+		"""
+		Return the cached iterations of the given key, or None if missing
+		"""
+		filename = self.filename( key )
+		if not os.path.isfile(filename):
+			return None
+
+		# Load entry
+		try:
+			with open(filename, "r") as f:
+				entry = json.load(f)
+		except ValueError:
+			self.logger.warn("Ignoring invalid cache entry %s" % filename)
+			return None
+
+		# Return iterations
+		return entry['iterations']
+
+	def store(self, key, iterations):
+		"""
+		Store the given iterations, each one a dictionary with the rendered
+		'values', the 'raw' values and their 'approx' flags and the
+		'started' and 'ended' times of the iteration
+		"""
+		if not iterations:
+			return
+
+		# Write entry atomically
+		filename = self.filename( key )
+		self.logger.debug("Storing %i iterations in %s" % (len(iterations), filename))
+		with open("%s.tmp" % filename, "w") as f:
+			json.dump({
+				'key': key,
+				'created': str(datetime.datetime.now()),
+				'iterations': iterations
+			}, f, default=str)
+		os.rename( "%s.tmp" % filename, filename )
@@ -5,9 +5,9 @@ import signal
 import logging
 import robob.logger
 
-from robob.util import time2sec
 from robob.specs import Specs
-from robob.driver import TestDriver
+from robob.reporter import ReportFile, merge_reports, reaggregate_series
+from robob.runner import TestScheduler, InterleavedScheduler, BudgetScheduler
 
 def help(verbose=False):
 	"""
@@ -16,8 +16,18 @@ def help(verbose=False):
 	print("RoBOB - Simplify collection of measurements over repetitive tasks")
 	print("Read more: https://github.com/wavesoft/robob/wiki")
 	print("")
-	print("Usage: robob [-v] <path-to-benchmark.yaml>")
+	print("Usage: robob [-v] [--shard <i>/<n>] [--resume <report.csv>] [--budget <time>] [--replay <output-dir>] <path-to-benchmark.yaml>")
+	print("       robob [-v] merge <merged.csv> <shard.csv> [<shard.csv> ...]")
+	print("       robob [-v] reaggregate <path-to-benchmark.yaml> <series-dir> <report.csv>")
 	print("")
+	if verbose:
+		print("Options:")
+		print("  -v               Enable verbose logging")
+		print("  --shard <i>/<n>  Run only the i-th out of n shards of the test-cases")
+		print("  --resume <file>  Continue the given report, running only the missing iterations")
+		print("  --budget <time>  Spread the iterations of the test-cases within the given time")
+		print("  --replay <dir>   Parse the output kept in the given directory instead of running the streams")
+		print("")
 	sys.exit(1)
 
 def main():
@@ -35,6 +45,54 @@ def main():
 	# Get a logger
 	logger = logging.getLogger("robob")
 
+	# Extract shard
+	shard = None
+	if '--shard' in sys.argv:
+		i = sys.argv.index('--shard')
+		try:
+			shard = [ int(x) for x in sys.argv[i+1].split("/") ]
+			if (len(shard) != 2) or (shard[0] < 1) or (shard[0] > shard[1]):
+				raise ValueError()
+		except (ValueError, IndexError):
+			logger.error("The shard must be specified as <i>/<n>, with 1 <= i <= n")
+			help()
+			return 1
+		shard = ( shard[0]-1, shard[1] )
+		del sys.argv[i:i+2]
+
+	# Extract report to resume
+	resume = None
+	if '--resume' in sys.argv:
+		i = sys.argv.index('--resume')
+		if (i+1 >= len(sys.argv)) or not os.path.isfile(sys.argv[i+1]):
+			logger.error("The report to resume was not found!")
+			help()
+			return 1
+		resume = sys.argv[i+1]
+		del sys.argv[i:i+2]
+
+	# Extract time budget
+	budget = None
+	if '--budget' in sys.argv:
+		i = sys.argv.index('--budget')
+		if i+1 >= len(sys.argv):
+			logger.error("The time budget was not specified!")
+			help()
+			return 1
+		budget = sys.argv[i+1]
+		del sys.argv[i:i+2]
+
+	# Extract the directory of the output to replay
+	replay = None
+	if '--replay' in sys.argv:
+		i = sys.argv.index('--replay')
+		if (i+1 >= len(sys.argv)) or not os.path.isdir(sys.argv[i+1]):
+			logger.error("The directory of the output to replay was not found!")
+			help()
+			return 1
+		replay = sys.argv[i+1]
+		del sys.argv[i:i+2]
+
 	# Show help screen if missing arguments
 	if len(sys.argv) < 2:
 		help()
@@ -45,6 +103,35 @@ def main():
 		help(True)
 		return 0
 
+	# Check for merge command
+	if sys.argv[1] == 'merge':
+		if len(sys.argv) < 4:
+			help()
+			return 2
+		try:
+			merge_reports( sys.argv[2], sys.argv[3:] )
+			return 0
+		except (IOError, ValueError) as e:
+			logger.error("%s: %s" % ( e.__class__.__name__, str(e)))
+			return 1
+
+	# Check for reaggregate command
+	if sys.argv[1] == 'reaggregate':
+		if len(sys.argv) < 5:
+			help()
+			return 2
+		try:
+			specs = Specs( sys.argv[2] )
+			specs.load()
+			reaggregate_series( specs, sys.argv[3], sys.argv[4] )
+			return 0
+		except KeyError as e:
+			logger.error("Missing expected key %s in the series or the specs file!" % str(e))
+			return 1
+		except (IOError, ValueError, AssertionError) as e:
+			logger.error("%s: %s" % ( e.__class__.__name__, str(e)))
+			return 1
+
 	# Validate file
 	specsfile = sys.argv[1]
 	if not os.path.isfile(specsfile):
@@ -58,13 +145,33 @@ def main():
 		# Load specs
 		specs = Specs( specsfile )
 		specs.load()
+		specs.replay = replay
 
 		# Create test contexts
 		tests = specs.createTestContexts()
+		if shard:
+			tests = tests.shard( *shard )
+			logger.info("Running shard %i/%i with %i out of %i tests" % (shard[0]+1, shard[1], len(tests), tests.total()))
+
+		# Create result cache, that is not used when replaying
+		cache = None
+		if not replay:
+			cache = specs.createCache()
 
 		# Create reporter
-		reporter = specs.createReporter()
-		reporter.start()
+		reporter = specs.createReporter( shard )
+		if resume:
+			reporter.resume( ReportFile(resume) )
+		else:
+			reporter.start()
+
+		# Create the scheduler of the tests
+		if budget or ('test.budget' in specs.context):
+			scheduler = BudgetScheduler( specs, reporter, cache, budget )
+		elif specs.context.get("test.order", "sequential") != "sequential":
+			scheduler = InterleavedScheduler( specs, reporter, cache )
+		else:
+			scheduler = TestScheduler( specs, reporter, cache )
 
 		# Gracefully shutdown
 		def cleanup(signal, frame):
@@ -72,9 +179,9 @@ def main():
 			# Interrupt reporter
 			logger.warn("Received break signal from the user")	
 
-			# Interrupt driver and reporter
-			driver.interrupt()
-			reporter.interrupt( driver.summarize() )
+			# Interrupt running tests and reporter
+			scheduler.interrupt()
+			reporter.interrupt( None )
 			reporter.close()
 
 			# Exit with error
@@ -83,47 +190,8 @@ def main():
 		# Trap shutdown signal
 		signal.signal(signal.SIGINT, cleanup)
 
-		# Create stream context for every test
-		driver = None
-		test_id = 0
-		for test in tests:
-
-			# Create a test driver
-			driver = TestDriver( specs, test )
-
-			# Get some values from test specs
-			iterations = int(test.get("test.iterations", 1))
-			cooldown = time2sec(test.get("test.cooldown", 0))
-
-			# Start reporting the test
-			reporter.test_start( test )
-
-			# Run multiple iterations of the test
-			for i in range( 0, iterations ):
-
-				# Calculate progress
-				p_total = (len(tests) * iterations)
-				p_curr = test_id * iterations + i
-
-				# Start log
-				logger.info("Running %i/%i (test: %i/%i, iteration: %i/%i, values: {%s})" % (p_curr+1, p_total, test_id+1, len(tests), i+1, iterations, \
-					", ".join([ "%s=\"%s\"" % (k, str(v)) for k,v in test['curr'].iteritems() ]) ))
-				reporter.iteration_start( i+1 )
-
-				# Run driver
-				driver.run(i)
-				reporter.iteration_end( driver.lastResults, driver.lastStatus, driver.lastComment )
-
-				# Apply cooldown
-				if cooldown:
-					logger.info("Waiting for %s sec before next test" % test.get("test.cooldown", "0"))
-					time.sleep(cooldown)
-
-			# Summarize iterations and finalize test
-			reporter.test_end( driver.summarize() )
-
-			# Increment test ID
-			test_id += 1
+		# Run every test
+		scheduler.run( tests )
 
 		# Finalize reporter
 		reporter.finalize()
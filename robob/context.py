@@ -1,19 +1,209 @@
 
 import logging
 import re
-import copy
 
 from collections import OrderedDict
+from robob.expression import compile_expression, MissingVariable
+try:
+	from collections.abc import MutableMapping
+except ImportError:
+	from collections import MutableMapping
 
 #: Macro regex
 RE_MACRO = re.compile(r'\$\{(.+?)\}')
 
-#: Macro variable regex
-RE_MACRO_VAR = re.compile(r'[a-z][a-z0-9\._]*', flags=re.IGNORECASE)
+#: Marker for keys deleted in a forked context
+_DELETED = object()
 
-class Context(OrderedDict):
+#: Cache of templated strings, parsed into segments
+_SEGMENTS = {}
+
+def parse_macros( text ):
+	"""
+	Parse the given string into a list of (literal, macro) segments,
+	where the macro of the last segment is None. The parsed segments
+	are cached, so every string is parsed only once.
+	"""
+	segments = _SEGMENTS.get(text)
+	if segments is None:
+
+		# Split on macros
+		segments = []
+		last = 0
+		for m in RE_MACRO.finditer(text):
+			segments.append( (text[last:m.start()], m.group(1)) )
+			last = m.end()
+		segments.append( (text[last:], None) )
+
+		# Keep the cache bounded
+		if len(_SEGMENTS) > 10000:
+			_SEGMENTS.clear()
+		_SEGMENTS[text] = segments
+
+	return segments
+
+class MacroResolver(object):
+	"""
+	Resolves the macros in the values of a context. Every key is resolved
+	once, after resolving the keys its macros depend on (depth-first, in
+	topological order), and circular dependencies are reported as errors.
+	"""
+
+	def __init__(self, context):
+		"""
+		Initialize a resolver for the given context
+		"""
+		self.context = context
+		self.resolved = {}
+		self.resolving = []
+		self.unreplaced = set()
+
+	def __contains__(self, key):
+		"""
+		Check if the key exists in the context
+		"""
+		return key in self.context
+
+	def __getitem__(self, key):
+		"""
+		Return the resolved value of the given key
+		"""
+		if key in self.resolved:
+			return self.resolved[key]
+
+		# Check for circular dependencies
+		if key in self.resolving:
+			cycle = self.resolving[ self.resolving.index(key): ] + [ key ]
+			raise AssertionError("Circular macro reference: %s" % " -> ".join([ "${%s}" % k for k in cycle ]))
+
+		# Resolve dependencies and value
+		self.resolving.append( key )
+		try:
+			value = self.render( self.context[key] )
+		finally:
+			self.resolving.pop()
+
+		# Keep resolved value
+		self.resolved[key] = value
+		return value
+
+	def render(self, value):
+		"""
+		Return a copy of the given value with all macros replaced
+		"""
+
+		# Replace all macros in dict
+		if isinstance(value, dict):
+			ans = {}
+			for k,v in value.items():
+				ans[k] = self.render(v)
+			return ans
+
+		# Replace all macros in list
+		elif isinstance(value, list):
+			return [ self.render(v) for v in value ]
+
+		# Replace all macros in string
+		elif isinstance(value, str):
+			segments = parse_macros( value )
+			if len(segments) == 1:
+				return value
+
+			# Evaluate macros
+			ans = ""
+			for literal, macro in segments:
+				ans += literal
+				if macro is None:
+					continue
+				v = self.context.evaluate( macro, self )
+				if v is None:
+					self.unreplaced.add( macro )
+					ans += "${%s}" % macro
+				else:
+					ans += str(v)
+			return ans
+
+		# Pass through everything else
+		else:
+			return value
+
+#: Marker for keys not found in the context layers
+_MISSING = object()
+
+#: Cache of the name index of lists, by list id
+_LIST_INDEX = {}
+
+def _list_index( value ):
+	"""
+	Return a dictionary that maps the names of the items in the given
+	list to the items. Items without names are mapped by their position.
+	The index is built once for every list.
+	"""
+	entry = _LIST_INDEX.get( id(value) )
+	if entry is not None and entry[0] is value:
+		return entry[1]
+
+	# Build index
+	index = {}
+	for i, v in enumerate(value):
+		if isinstance(v, dict) and 'name' in v:
+			index[str(v['name'])] = v
+		else:
+			index[str(i)] = v
+
+	# Keep the cache bounded
+	if len(_LIST_INDEX) > 10000:
+		_LIST_INDEX.clear()
+	_LIST_INDEX[ id(value) ] = (value, index)
+
+	return index
+
+def _child( value, name ):
+	"""
+	Return the (found, child) tuple of the child with the given
+	name in the given dict or list
+	"""
+	if isinstance(value, dict):
+		if name in value:
+			return (True, value[name])
+		if name.isdigit() and int(name) in value:
+			return (True, value[int(name)])
+	elif isinstance(value, list):
+		index = _list_index(value)
+		if name in index:
+			return (True, index[name])
+	return (False, None)
+
+def _walk( value, parts, i=0 ):
+	"""
+	Walk the given dotted path parts in the nested value and return a
+	(found, value) tuple. Since names can contain dots, the longest names
+	are tried first.
+	"""
+	if i == len(parts):
+		return (True, value)
+	for j in range(len(parts), i, -1):
+		(found, child) = _child( value, ".".join(parts[i:j]) )
+		if found:
+			(found, child) = _walk( child, parts, j )
+			if found:
+				return (True, child)
+	return (False, None)
+
+class Context(MutableMapping):
 	"""
 	An environment variable and context
+
+	The context is a stack of dictionary layers that are searched from the
+	top. Forking a context shares all of its layers with the fork, giving
+	each one of them a new, empty top layer where their writes go to. This
+	way only the keys that are actually written are copied.
+
+	Values that are set with set() also expose their nested contents with
+	dotted keys (ex. 'node.sender.host'). These keys are resolved lazily by
+	walking the nested values. Exact keys always have precedence, and when
+	the same name is set more than once, the most recent value is searched
+	first.
 	"""
 
 	@staticmethod
@@ -43,85 +233,162 @@ class Context(OrderedDict):
 		# Return definitions
 		return defs
 
-	def __init__(self, contents={}, definitions=set()):
+	def __init__(self, contents={}, definitions=set(), roots=None):
 		"""
-		Initialize parent dictionary
+		Initialize the top layer with the given contents
 		"""
-		OrderedDict.__init__(self, contents)
+		self._top = OrderedDict(contents)
+		self._base = ()
 		self._definitions = definitions
 
+		# The values set with set(), newest first, by name
+		self._roots = roots or {}
+		self._rootsShared = False
+
 	def fork(self):
 		"""
-		Deep copy current context into another context
+		Fork current context into another, copy-on-write context
+		"""
+
+		# Freeze our top layer, since it's now shared with the fork
+		if self._top:
+			self._base = (self._top,) + self._base
+			self._top = OrderedDict()
+
+		# Create a context on top of the same layers and roots
+		ctx = Context( definitions=self._definitions )
+		ctx._base = self._base
+		ctx._roots = self._roots
+		ctx._rootsShared = True
+		self._rootsShared = True
+		return ctx
+
+	def _exact(self, key):
+		"""
+		Return the value of the exact key from the top-most layer
+		"""
+		if key in self._top:
+			return self._top[key]
+		for layer in self._base:
+			if key in layer:
+				return layer[key]
+		return _MISSING
+
+	def _lookup(self, key):
+		"""
+		Return the value of the given exact or dotted key, or
+		_MISSING if it's not defined
+		"""
+
+		# Exact keys have precedence
+		value = self._exact(key)
+		if value is _DELETED:
+			return _MISSING
+		if value is not _MISSING or not '.' in key:
+			return value
+
+		# Walk the values of the longest root name first
+		parts = key.split(".")
+		for i in range(len(parts) - 1, 0, -1):
+			values = self._roots.get( ".".join(parts[0:i]) )
+			if values:
+				for v in values:
+					(found, v) = _walk( v, parts, i )
+					if found:
+						return v
+
+		# Not found
+		return _MISSING
+
+	def __getitem__(self, key):
+		"""
+		Return the value of the given key
+		"""
+		value = self._lookup(key)
+		if value is _MISSING:
+			raise KeyError(key)
+		return value
+
+	def __contains__(self, key):
+		"""
+		Check if the given key exists
+		"""
+		return self._lookup(key) is not _MISSING
+
+	def __setitem__(self, key, value):
+		"""
+		Set the given key on the top layer
+		"""
+		self._top[key] = value
+
+	def __delitem__(self, key):
+		"""
+		Delete the given key, masking it if it's defined on a shared layer
+		"""
+		if not key in self:
+			raise KeyError(key)
+		if key in self._top:
+			del self._top[key]
+
+		# Mask the key if still visible
+		if key in self:
+			self._top[key] = _DELETED
+
+	def __iter__(self):
+		"""
+		Iterate over the visible exact keys of all layers
 		"""
-		return Context( copy.deepcopy(self), self._definitions )
+		seen = set()
+		for layer in (self._top,) + self._base:
+			for k, v in layer.items():
+				if not k in seen:
+					seen.add(k)
+					if v is not _DELETED:
+						yield k
+
+	def __len__(self):
+		"""
+		Count the visible exact keys of all layers
+		"""
+		return sum([ 1 for k in self ])
+
+	def __repr__(self):
+		return "Context(%r)" % dict(self.items())
 
 	def set(self, name, value, include_flag=True):
 		"""
 		Set the specified value in the context and optionally
-		also update a flat representation of the value.
+		also expose its nested values with dotted keys.
 		"""
 
 		# Set value
 		self[name] = value
 
-		# Update flat representation
+		# Keep it as root of dotted keys
 		if include_flag:
-	
-			if isinstance(value, dict):
-				for k,v in value.items():
-					self.set( "%s.%s" % (name,k), v )
-
-			elif isinstance(value, list):
-				i = 0
-				for v in value:
-					if 'name' in v:
-						self.set( "%s.%s" % (name,v['name']), v )
-					else:
-						self.set( "%s.%i" % (name,i), v )
-					i += 1
+			if self._rootsShared:
+				self._roots = dict(self._roots)
+				self._rootsShared = False
+			self._roots[name] = (value,) + self._roots.get(name, ())
 
 	def merge(self, name, value, include_flag=True):
 		"""
 		Merge the specified value in the context and optionally
-		also update a flat representation of the value.
+		also expose its nested values with dotted keys.
 		"""
 
-		# Set value
+		# Merge with the previous value (values are never modified
+		# in-place, since they might be shared with other contexts)
 		if name in self:
-			if isinstance(value, dict):
-
-				# Merge list
-				i = len(self[name])
-				self[name] += value
-
-				# Update flat representation
-				if include_flag:
-					for v in value:
-						if 'name' in v:
-							self.set( "%s.%s" % (name,v['name']), v )
-						else:
-							self.set( "%s.%i" % (name,i), v )
-						i += 1
-
-				# Don't continue
-				return
-
-			elif isinstance(value, list):
-
-				# Merge dictionary
-				self[name].update( value )
-
-				# Update flat representation
-				if include_flag:
-					for k,v in value.items():
-						self.set( "%s.%s" % (name,k), v )
-
-				# Don't continue
-				return
+			if isinstance(value, list):
+				value = self[name] + value
+			elif isinstance(value, dict):
+				merged = dict(self[name])
+				merged.update( value )
+				value = merged
 
 		# Update value
-		self[name] = value
+		self.set( name, value, include_flag )
 
 	def render(self):
 		"""
@@ -130,134 +397,52 @@ class Context(OrderedDict):
 		"""
 		logger = logging.getLogger('context')
 
-		# Prepare properties
-		self._unreplaced = set()
-		replaced = True
-
-		# Deep-copy dictionary
-		dictionary = copy.deepcopy(self)
-
-		# Keep replacing until there are no other macros to replace
-		while replaced:
-			# Replace and check if this was indeed replaced
-			(dictionary, replaced) = self.replaceMacros( dictionary )
+		# Resolve every key, in the order of their dependencies
+		resolver = MacroResolver( self )
+		dictionary = {}
+		for k in self:
+			dictionary[k] = resolver[k]
+
+		# Render the values of the dotted keys, re-using the
+		# values already rendered for exact keys
+		roots = {}
+		for k, values in self._roots.items():
+			roots[k] = tuple([
+					dictionary[k] if (k in dictionary and self._exact(k) is v) else resolver.render(v)
+					for v in values
+				])
 
 		# Log unreplaced items
-		for m in self._unreplaced:
+		for m in resolver.unreplaced:
 			if not m in self._definitions:
 				logger.warn("Unknown macro '${%s}' encountered in specifications!" % m)
 
 		# Return a new context with the new dictionary
-		return Context( dictionary )
+		return Context( dictionary, roots=roots )
 
-	def evaluate(self, expr):
+	def evaluate(self, expr, values=None):
 		"""
-		Evaluate a macro expression
+		Evaluate a macro expression, looking up the variables
+		in the given values (or in this context)
 		"""
-		logger = logging.getLogger('context')
-
-		# Reset properties
-		self._evalMissing = False
+		if values is None:
+			values = self
 
 		# Extract default value
 		defaultValue = None
 		if '|' in expr:
 			(expr, defaultValue) = expr.split("|", 1)
 
-		# Check if this is an expression
-		if ('*' in expr) or ('+' in expr) or ('/' in expr) or ('%' in expr) or \
-			('-' in expr) or ('^' in expr) or ('(' in expr) or (')' in expr):
-
-			# Replace helper
-			def replace(m):
-				key = m.group(0)
-
-				# Ignore some functions
-				if key in [ 'str', 'int', 'float', 'pow', 'round' ]:
-					return m.group(0)
-
-				# Replace values
-				if not key in self:
-					self._evalMissing = True
-					return ""
-				else:
-
-					# Check if we should wrap value in quotes
-					value = str(self[key])
-					if value.isdigit() or ((value.count(".") == 1) and value.replace(".","").isdigit()):
-						return value
-					else:
-						return '"%s"' % value.replace('"', '\\"')
-
-			# Expand variables
-			eval_expr = RE_MACRO_VAR.sub( replace, expr )
-
-			# Check if we had missing properties
-			if self._evalMissing:
-				return defaultValue
-
-			# Otherwise evaluate expression
-			try:
-				return eval(eval_expr)
-			except Exception as e:
-				logger.warn("Error evaluating macro expression '%s': %s" % (expr, str(e)))
-				return defaultValue
-
-		else:
-
-			# It's a plain value, return calculation
-			if expr in self:
-				return self[expr]
-			else:
-				return defaultValue
-
-	def replaceMacros(self, where, _firstCall=True):
-		"""
-		Replace all macros in context to the given string
-		"""
-		unused = False
-
-		# Check if a value was indeed updated
-		if _firstCall:
-			self._did_replace = False
-
-		# Replace helper
-		def replace(m):
-			# Try to evaluate expression
-			key = m.group(1)
-			value = self.evaluate( key )
-			if value is None:
-				# Return un-replaced
-				self._unreplaced.add(key)
-				return m.group(0)
-			else:
-				# Return replaced & mark action
-				self._did_replace = True
-				# Remove from unreplaced
-				if key in self._unreplaced:
-					self._unreplaced.remove(key)
-				return str(value)
-
-		# Replace all macros in dict
-		if isinstance(where, dict):
-			ans = {}
-			for k,v in where.items():
-				(ans[k], unused) = self.replaceMacros(v, False)
-
-			return (ans, self._did_replace)
-
-		# Replace all macros in list
-		elif isinstance(where, list):
-			ans = []
-			for v in where:
-				ans.append( self.replaceMacros(v, False)[0] )
-			return (ans, self._did_replace)
-
-		# Replace all macros in string
-		elif isinstance(where, str):
-			return (RE_MACRO.sub( replace, where ), self._did_replace)
-
-		# Pass through everything else
-		else:
-			return (where, self._did_replace)
-
+		# Plain values are returned as-is
+		if expr in values:
+			return values[expr]
+
+		# Otherwise evaluate the compiled expression
+		try:
+			return compile_expression( expr ).evaluate( values )
+		except MissingVariable:
+			return defaultValue
+		except (ValueError, TypeError, ArithmeticError) as e:
+			logger = logging.getLogger('context')
+			logger.warn("Error evaluating macro expression '%s': %s" % (expr, str(e)))
+			return defaultValue
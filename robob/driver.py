@@ -1,15 +1,18 @@
 
 import errno
 import time
+import heapq
 import signal
 import select
+import itertools
 import logging
 
 import pty, os, fcntl, termios
 
 from threading import Thread
 from subprocess import Popen, PIPE
-from robob.metrics import Metrics, summarize
+from robob.metrics import Metrics, summarize, set_clock
+from robob.logpipe import LogReader, log_filename
 
 class PtyProcess:
 
@@ -412,6 +415,8 @@ class TestDriver:
 		self.metrics = Metrics()
 		self.metrics.configure( test )
 
+		self.streams = None
+		self.threads = []
 		self.results = []
 		self.lastResults = None
 		self.lastStatus = ""
@@ -422,8 +427,13 @@ class TestDriver:
 		Start the tests on the test driver
 		"""
 
-		# Create all stream specifications on this context
-		streams = self.specs.createStreams( self.test, self.metrics, iteration )
+		# Create all stream specifications on this context once, and
+		# then only prepare them for every iteration
+		if self.streams is None:
+			self.streams = self.specs.createStreams( self.test, self.metrics, iteration )
+		streams = self.streams
+		for s in streams:
+			s.prepare( iteration )
 
 		# Reset metrics
 		self.metrics.reset()
@@ -506,6 +516,30 @@ class TestDriver:
 		self.lastResults = self.metrics.results()
 		self.results.append( self.lastResults )
 
+	def release(self):
+		"""
+		Release the output logs and the buffers of the streams and the
+		series of the last run, until the next run prepares them again.
+		The streams are kept, so they are not configured again.
+		"""
+		for s in (self.streams or []):
+			s.release()
+		self.metrics.reset()
+
+	def restore(self, iterations):
+		"""
+		Restore the results of the iterations completed in a previous
+		run, from their rendered values or from the cached iterations
+		(see ResultCache), that keep their raw values as well
+		"""
+		for it in iterations:
+			if not isinstance(it, dict):
+				self.results.append( self.metrics.parse(it) )
+			elif 'raw' in it:
+				self.results.append( self.metrics.load(it['raw'], it.get('approx', None)) )
+			else:
+				self.results.append( self.metrics.parse(it['values']) )
+
 	def summarize(self):
 		"""
 		Summarize results
@@ -519,13 +553,9 @@ class TestDriver:
 		Interrupt current run
 		"""
 
-		# Collect results
+		# Interrupt all threads
 		self.logger.warn("Driver interrupted (%s), stopping all threads" % reason)
 		self.lastStatus = reason
-		self.lastResults = self.metrics.results()
-		self.results.append( self.lastResults )
-
-		# Interrupt all threads
 		for t in self.threads:
 			self.logger.debug("Interrupting stream thread %s" % t.stream.name)
 			t.interrupt()
@@ -534,3 +564,99 @@ class TestDriver:
 		for t in self.threads:
 			self.logger.debug("Joining stream thread %s" % t.stream.name)
 			t.join()
+
+		# Collect results when no stream is writing anymore
+		self.lastResults = self.metrics.results()
+		self.results.append( self.lastResults )
+
+class ReplayDriver(TestDriver):
+	"""
+	A test driver that instead of starting the streams, feeds the output
+	kept by a previous run (see 'report.keep_output') through the same
+	pipes and parsers, as fast as possible. The values are collected with
+	the timestamps of the captured lines, when the capture has them.
+	"""
+
+	def __init__(self, specs, test, path):
+		"""
+		Initialize a replay driver that reads the captured output from
+		the given directory
+		"""
+		TestDriver.__init__(self, specs, test)
+		self.path = path
+
+	def run(self, iteration):
+		"""
+		Replay the captured output of the given iteration
+		"""
+
+		# Create all stream specifications once, and reset them for every
+		# iteration without re-opening (and overwriting) their output logs
+		if self.streams is None:
+			self.streams = self.specs.createStreams( self.test, self.metrics, iteration )
+		streams = [ s for s in self.streams if s.active ]
+		for s in streams:
+			s.iteration = iteration
+			s.pipe.pipe_reset()
+		self.lastStatus = "Completed"
+		self.lastComment = "Replayed"
+
+		# Open the captured output of every stream
+		readers = []
+		for s in streams:
+			filename = log_filename( self.path, s.logName() )
+			if filename is None:
+				self.logger.warn("Missing captured output %s in %s" % (s.logName(), self.path))
+				self.lastStatus = "Error"
+				self.lastComment += "; %s not captured" % s.name
+				continue
+			self.logger.debug("Replaying %s" % filename)
+			try:
+				readers.append( (s, LogReader(filename)) )
+			except (IOError, ValueError) as e:
+				self.logger.error("Unable to read %s: %s" % (filename, str(e)))
+				self.lastStatus = "Error"
+				self.lastComment += "; %s not readable" % s.name
+
+		# Reset metrics at the time the capture started
+		started = [ r.started for s, r in readers if not r.started is None ]
+		set_clock( min(started) if started else None )
+		self.metrics.reset()
+
+		# Feed the captured lines in the order they were captured, if all
+		# captures have timestamps. The framed logs are fed to the bash
+		# wrappers, that route them to the application and the streamlets,
+		# and the plain logs to the application.
+		try:
+			feeds = [ self.feed( k, r ) for k, (s, r) in enumerate(readers) ]
+			if len(started) == len(readers):
+				lines = heapq.merge( *feeds )
+			else:
+				lines = itertools.chain( *feeds )
+			for t, k, channel, line in lines:
+				set_clock( t )
+				s, r = readers[k]
+				pipe = s.bashPipe if r.framed else s.appPipe
+				if channel == "stderr":
+					pipe.pipe_stderr( line )
+				else:
+					pipe.pipe_stdout( line )
+		except Exception as e:
+			self.logger.error("%s occured: %s" % (e.__class__.__name__, str(e)) )
+			self.lastStatus = "Error"
+			self.lastComment += "; %s: %s" % (e.__class__.__name__, str(e))
+		finally:
+			set_clock( None )
+		for s in streams:
+			s.pipe.pipe_close()
+
+		# Collect results
+		self.lastResults = self.metrics.results()
+		self.results.append( self.lastResults )
+
+	def feed(self, k, reader):
+		"""
+		Yield the (time, stream index, channel, line) of every captured line
+		"""
+		for t, channel, line in reader.lines():
+			yield (t, k, channel, line)
@@ -0,0 +1,385 @@
+
+import re
+import ast
+import operator
+
+#: Expression token regex
+RE_TOKEN = re.compile(r"""\s*(?:
+	(?P<number>(?:[0-9]+\.[0-9]*|\.[0-9]+|[0-9]+)(?:[eE][-+]?[0-9]+)?) |
+	(?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*') |
+	(?P<name>[A-Za-z_][A-Za-z0-9_\.]*(?:-[A-Za-z_][A-Za-z0-9_\.]*)*) |
+	(?P<op>\*\*|//|==|!=|<=|>=|[-+*/%^(),<>])
+	)""", re.VERBOSE)
+
+#: Functions that can be called from expressions
+FUNCTIONS = {
+	'str': str,
+	'int': int,
+	'float': float,
+	'pow': pow,
+	'round': round,
+	'min': min,
+	'max': max,
+	'abs': abs,
+}
+
+#: Binary operators, by precedence level (lowest first)
+BINARY_OPERATORS = [
+	{ '==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge },
+	{ '^': operator.xor },
+	{ '+': operator.add, '-': operator.sub },
+	{ '*': operator.mul, '/': getattr(operator, 'div', operator.truediv), '//': operator.floordiv, '%': operator.mod },
+]
+
+#: Unary operators
+UNARY_OPERATORS = {
+	'-': operator.neg,
+	'+': operator.pos,
+}
+
+#: Boolean operators, that are written as words
+KEYWORDS = set([ 'and', 'or', 'not' ])
+
+#: Cache of compiled expressions
+_COMPILED = {}
+
+class MissingVariable(Exception):
+	"""
+	A variable used in the expression is not defined
+	"""
+	pass
+
+def coerce( value ):
+	"""
+	Convert values that look like numbers into numbers, the same way
+	they are written in the expressions
+	"""
+	if type(value) in [int, float]:
+		return value
+	value = str(value)
+	if value.isdigit():
+		return int(value)
+	if (value.count(".") == 1) and value.replace(".","").isdigit():
+		return float(value)
+	return value
+
+def tokenize( text, dashes=True ):
+	"""
+	Split the expression text into a list of (kind, value) tokens. If
+	dashes is True, names can contain dashes (ex. 'queue-size'), otherwise
+	dashes are always considered subtraction operators.
+	"""
+	tokens = []
+	pos = 0
+	text = text.rstrip()
+	while pos < len(text):
+
+		# Match next token
+		m = RE_TOKEN.match( text, pos )
+		if not m or m.end() == pos:
+			raise ValueError("Unexpected character '%s' in expression '%s'" % (text[pos:].strip()[0:1], text))
+		pos = m.end()
+
+		# Collect token
+		kind = m.lastgroup
+		value = m.group(kind)
+		if kind == 'name' and not dashes and '-' in value:
+			parts = value.split('-')
+			tokens.append( ('name', parts[0]) )
+			for p in parts[1:]:
+				tokens.append( ('op', '-') )
+				tokens.append( ('name', p) )
+		else:
+			tokens.append( (kind, value) )
+
+	return tokens
+
+class _Parser(object):
+	"""
+	Recursive-descent parser that compiles tokens into closures
+	"""
+
+	def __init__(self, text, tokens):
+		"""
+		Initialize parser
+		"""
+		self.text = text
+		self.tokens = tokens
+		self.pos = 0
+		self.names = set()
+
+	def peek(self):
+		"""
+		Return the next token without consuming it
+		"""
+		if self.pos < len(self.tokens):
+			return self.tokens[self.pos]
+		return (None, None)
+
+	def next(self):
+		"""
+		Consume and return the next token
+		"""
+		tok = self.peek()
+		self.pos += 1
+		return tok
+
+	def expect(self, value):
+		"""
+		Consume the given operator token or fail
+		"""
+		kind, v = self.next()
+		if kind != 'op' or v != value:
+			self.fail( v )
+
+	def fail(self, value):
+		"""
+		Raise a syntax error
+		"""
+		if value is None:
+			raise ValueError("Unexpected end of expression '%s'" % self.text)
+		raise ValueError("Unexpected '%s' in expression '%s'" % (value, self.text))
+
+	def parse(self):
+		"""
+		Parse the entire expression
+		"""
+		fn = self.expression()
+		kind, v = self.peek()
+		if kind is not None:
+			self.fail( v )
+		return fn
+
+	def expression(self):
+		"""
+		Parse the (lowest precedence) 'or' operator
+		"""
+		left = self.conjunction()
+		while self.peek() == ('name', 'or'):
+			self.next()
+			left = _or( left, self.conjunction() )
+		return left
+
+	def conjunction(self):
+		"""
+		Parse the 'and' operator
+		"""
+		left = self.negation()
+		while self.peek() == ('name', 'and'):
+			self.next()
+			left = _and( left, self.negation() )
+		return left
+
+	def negation(self):
+		"""
+		Parse the 'not' operator
+		"""
+		if self.peek() == ('name', 'not'):
+			self.next()
+			return _unary( operator.not_, self.negation() )
+		return self.binary(0)
+
+	def binary(self, level):
+		"""
+		Parse binary operators of the given precedence level
+		"""
+		if level >= len(BINARY_OPERATORS):
+			return self.unary()
+		ops = BINARY_OPERATORS[level]
+
+		# Left-associative chain
+		left = self.binary(level + 1)
+		while True:
+			kind, v = self.peek()
+			if kind != 'op' or not v in ops:
+				return left
+			self.next()
+			left = _binary( ops[v], left, self.binary(level + 1) )
+
+	def unary(self):
+		"""
+		Parse unary operators
+		"""
+		kind, v = self.peek()
+		if kind == 'op' and v in UNARY_OPERATORS:
+			self.next()
+			return _unary( UNARY_OPERATORS[v], self.unary() )
+		return self.power()
+
+	def power(self):
+		"""
+		Parse the (right-associative) power operator
+		"""
+		base = self.atom()
+		kind, v = self.peek()
+		if kind == 'op' and v == '**':
+			self.next()
+			return _binary( operator.pow, base, self.unary() )
+		return base
+
+	def atom(self):
+		"""
+		Parse numbers, strings, variables, function calls and parentheses
+		"""
+		kind, v = self.next()
+
+		# Literals
+		if kind == 'number':
+			if ('.' in v) or ('e' in v) or ('E' in v):
+				return _constant( float(v) )
+			return _constant( int(v) )
+		elif kind == 'string':
+			return _constant( ast.literal_eval(v) )
+
+		# Function calls or variables
+		elif kind == 'name':
+			nkind, nv = self.peek()
+			if nkind == 'op' and nv == '(':
+				if not v in FUNCTIONS:
+					raise ValueError("Unknown function '%s' in expression '%s'" % (v, self.text))
+				self.next()
+				args = []
+				if self.peek() != ('op', ')'):
+					args.append( self.expression() )
+					while self.peek() == ('op', ','):
+						self.next()
+						args.append( self.expression() )
+				self.expect(')')
+				return _call( FUNCTIONS[v], args )
+			if v in KEYWORDS:
+				self.fail( v )
+			self.names.add( v )
+			return _variable( v )
+
+		# Parentheses
+		elif kind == 'op' and v == '(':
+			fn = self.expression()
+			self.expect(')')
+			return fn
+
+		# Anything else is an error
+		self.fail( v )
+
+def _constant( value ):
+	def evaluate( values ):
+		return value
+	return evaluate
+
+def _variable( name ):
+	def evaluate( values ):
+		if not name in values:
+			raise MissingVariable(name)
+		return coerce( values[name] )
+	return evaluate
+
+def _unary( op, arg ):
+	def evaluate( values ):
+		return op( arg(values) )
+	return evaluate
+
+def _binary( op, left, right ):
+	def evaluate( values ):
+		return op( left(values), right(values) )
+	return evaluate
+
+def _and( left, right ):
+	def evaluate( values ):
+		return left(values) and right(values)
+	return evaluate
+
+def _or( left, right ):
+	def evaluate( values ):
+		return left(values) or right(values)
+	return evaluate
+
+def _call( fn, args ):
+	def evaluate( values ):
+		return fn( *[ a(values) for a in args ] )
+	return evaluate
+
+class Expression(object):
+	"""
+	A macro expression compiled into a restricted tree of arithmetic,
+	comparison and boolean operators, variables and whitelisted
+	function calls.
+
+	Dashes are read as subtractions, as they always were, so
+	'${size*queue-size}' is 'size*queue - size'. Only if that fails
+	because a variable is not defined, the dashed names are looked
+	up as variables (ex. a 'queue-size' global).
+	"""
+
+	def __init__(self, text):
+		"""
+		Compile the given expression text
+		"""
+		self.text = text
+
+		# Compile expression, reading dashes as subtractions
+		self.names = set()
+		self.fn = None
+		error = None
+		try:
+			self.fn = self.compile( tokenize(text, False) )
+		except ValueError as e:
+			error = e
+
+		# Compile the alternative with dashed names
+		self.dashed = None
+		tokens = tokenize( text )
+		if [ v for k, v in tokens if (k == 'name') and ('-' in v) ]:
+			try:
+				self.dashed = self.compile( tokens )
+			except ValueError:
+				pass
+
+		# Raise syntax errors
+		if self.fn is None and self.dashed is None:
+			raise error
+
+	def compile(self, tokens):
+		"""
+		Compile the given tokens, collecting the names of their variables
+		"""
+		parser = _Parser( self.text, tokens )
+		fn = parser.parse()
+		self.names = self.names | parser.names
+		return fn
+
+	def evaluate(self, values):
+		"""
+		Evaluate the expression looking up the variables in the given
+		values. Raises MissingVariable if a variable is not defined.
+		"""
+		if self.fn is None:
+			return self.dashed( values )
+		try:
+			return self.fn( values )
+		except MissingVariable:
+			if self.dashed is None:
+				raise
+			return self.dashed( values )
+
+def compile_expression( text ):
+	"""
+	Compile the given expression text, or return the cached
+	compiled expression
+	"""
+	expr = _COMPILED.get(text)
+	if expr is None:
+
+		# Keep the cache bounded
+		if len(_COMPILED) > 10000:
+			_COMPILED.clear()
+
+		# Compile, caching errors as well
+		try:
+			expr = Expression( text )
+		except ValueError as e:
+			expr = e
+		_COMPILED[text] = expr
+
+	# Raise syntax errors
+	if isinstance(expr, ValueError):
+		raise expr
+	return expr
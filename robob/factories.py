@@ -15,9 +15,10 @@ def parserFactory( specs, context, metrics ):
 	Create a parser from the specs dict
 	"""
 
-	# Extract class
-	cls_name = specs['class']
-	del specs['class']
+	# Extract class (without modifying the specs, which
+	# might be shared with other contexts)
+	specs = dict(specs)
+	cls_name = specs.pop('class')
 
 	# Get class
 	cls = _class_by_name( cls_name, 'Parser' )
@@ -34,9 +35,10 @@ def pipeFactory( specs, context ):
 	Create a pipe from the specs dict
 	"""
 
-	# Extract class
-	cls_name = specs['class']
-	del specs['class']
+	# Extract class (without modifying the specs, which
+	# might be shared with other contexts)
+	specs = dict(specs)
+	cls_name = specs.pop('class')
 
 	# Get class
 	cls = _class_by_name( cls_name, 'Pipe' )
@@ -53,9 +55,10 @@ def aggregateFactory( specs, metric ):
 	Create an aggregator from the specs dict
 	"""
 
-	# Extract class
-	cls_name = specs['class']
-	del specs['class']
+	# Extract class (without modifying the specs, which
+	# might be shared with other contexts)
+	specs = dict(specs)
+	cls_name = specs.pop('class')
 
 	# Get class
 	cls = _class_by_name( cls_name, 'Aggregate' )
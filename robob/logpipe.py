@@ -1,25 +1,427 @@
 
+import os
+import zlib
+import gzip
+import struct
+import logging
+
+try:
+	import lzma
+except ImportError:
+	lzma = None
+
+from robob.util import monotime
+from robob.writer import BufferedWriter
 from robob.pipe import PipeListener
 
-class LogPipe(PipeListener):
+#: Magic bytes at the beginning of the framed logs
+MAGIC = b"RBOL\x01"
+
+#: Header of the framed logs, with the time the log was opened
+HEADER = struct.Struct("<d")
+
+#: Header of every line, with the microseconds since the log was opened,
+#: the length of the line and its channel
+FRAME = struct.Struct("<QIB")
+
+#: Entry of the offset index, with the number and the microseconds of the
+#: first line of a block and the offset of the block in the file
+INDEX = struct.Struct("<QQQ")
+
+#: Names of the channels
+CHANNELS = [ "stdout", "stderr" ]
+
+#: File extensions of the formats and the compressions
+FORMATS = { 'framed': ".rec", 'plain': ".log" }
+COMPRESSIONS = { 'none': "", 'gzip': ".gz", 'lzma': ".xz" }
+
+#: Errors of truncated (ex. interrupted) compressed logs
+_TRUNCATED = (EOFError, IOError, zlib.error)
+if lzma:
+	_TRUNCATED += (lzma.LZMAError,)
+
+def log_extension(format="plain", compression="none"):
+	"""
+	Return the file extension of the logs with the given format and compression
+	"""
+	if not format in FORMATS:
+		raise AssertionError("Unknown output format '%s'" % format)
+	if not compression in COMPRESSIONS:
+		raise AssertionError("Unknown output compression '%s'" % compression)
+	return FORMATS[format] + COMPRESSIONS[compression]
+
+def log_filename(path, name):
+	"""
+	Return the filename of the log with the given name (without extension)
+	in the given directory, in any format and compression, or None if missing
+	"""
+	for format in [ "framed", "plain" ]:
+		for compression in [ "none", "gzip", "lzma" ]:
+			filename = os.path.join( path, name + log_extension(format, compression) )
+			if os.path.isfile(filename):
+				return filename
+	return None
+
+class LogWriter(BufferedWriter):
+	"""
+	Writes the lines of a log from a background thread, so that the stream
+	readers only queue them. The lines are written in blocks, which are
+	compressed separately, so the log can be read from the start of
+	any block.
+
+	  report:
+	    keep_output: ./output
+	    output_format: plain        # 'plain' or 'framed'
+	    output_compression: gzip    # 'none', 'gzip' or 'lzma'
+
+	The plain logs only keep the text of the lines. The framed logs keep
+	the time (from a monotonic clock) and the channel of every line, and
+	an index of the blocks (see LogReader). The pending lines are written
+	every 'report.flush' interval, following the 'report.durability'
+	(see BufferedWriter). The same writer (and thread) can continue in a
+	new log with open().
+	"""
+
+	#: How many bytes of lines to put in a block
+	BLOCK_SIZE = 262144
+	BUFFER_SIZE = BLOCK_SIZE
+
+	#: How many bytes of lines to queue before waiting for the writer
+	MAX_PENDING = 16777216
+
+	def __init__(self, filename, format="plain", compression="none", interval=1.0, durability="flush"):
+		"""
+		Create the given log file
+		"""
+		if not format in FORMATS:
+			raise AssertionError("Unknown output format '%s'" % format)
+		if not compression in COMPRESSIONS:
+			raise AssertionError("Unknown output compression '%s'" % compression)
+		if (compression == "lzma") and (lzma is None):
+			raise AssertionError("The lzma output compression is not available")
+		BufferedWriter.__init__(self, filename, interval, durability)
+		self.framed = (format == "framed")
+		self.compression = compression
+		self.logger = logging.getLogger("logpipe")
+
+		# Open log and start the writer thread
+		self.create( filename )
+		self.start()
+
+	def create(self, filename):
+		"""
+		Create the given log file and its index, starting the clock
+		"""
+		self.filename = filename
+
+		# Open log and index
+		self.fd = open( filename, "wb" )
+		self.index = None
+		if self.framed:
+			self.index = open( filename + ".idx", "wb" )
+		self.offset = 0
+		self.lines = 0
+
+		# Start the clock, keeping the time in the header
+		self.started = monotime()
+		if self.framed:
+			self.block( None, [ MAGIC + HEADER.pack(self.started) ] )
+			self.fd.flush()
+
+	def open(self, filename):
+		"""
+		Write the pending lines and continue in the given log file
+		"""
+		self.flush()
+		with self.lock:
+			self.release()
+			self.create( filename )
+
+	def write(self, line, channel=0):
+		"""
+		Queue the given line of the given channel for writing. The lines
+		are framed by the writer, so only their length is counted here.
+		"""
+		us = int( (monotime() - self.started) * 1000000 )
+		self.queue( (us, channel, line), len(line) + FRAME.size )
+
+	def dump(self, pending):
+		"""
+		Write the given lines in blocks
+		"""
+
+		# Split lines in blocks
+		first = None
+		frames = []
+		size = 0
+		for us, channel, line in pending:
+			if not isinstance(line, bytes):
+				line = line.encode("utf-8")
+			if self.framed:
+				data = FRAME.pack( us, len(line), channel ) + line
+			else:
+				data = line + b"\n"
+			if first is None:
+				first = (self.lines, us)
+			frames.append( data )
+			size += len(data)
+			self.lines += 1
+			if size >= self.BLOCK_SIZE:
+				self.block( first, frames )
+				first = None
+				frames = []
+				size = 0
+		if frames:
+			self.block( first, frames )
+
+		# Hand them to the operating system
+		self.fd.flush()
+		if self.index:
+			self.index.flush()
+
+	def block(self, first, frames):
+		"""
+		Write the given frames as a block, indexing it by the given (line,
+		microseconds) of its first line
+		"""
+		data = b"".join( frames )
+
+		# Compress block
+		if self.compression == "gzip":
+			c = zlib.compressobj( 6, zlib.DEFLATED, 31 )
+			data = c.compress( data ) + c.flush()
+		elif self.compression == "lzma":
+			data = lzma.compress( data )
+
+		# Write the block before its index entry
+		self.fd.write( data )
+		if self.index and first:
+			self.index.write( INDEX.pack( first[0], first[1], self.offset ) )
+		self.offset += len(data)
+
+	def fileno(self):
+		"""
+		Return the descriptor of the log
+		"""
+		return self.fd.fileno()
+
+	def release(self):
+		"""
+		Close the log and its index
+		"""
+		self.fd.close()
+		self.fd = None
+		if self.index:
+			self.index.close()
+			self.index = None
+
+class LogReader(object):
 	"""
-	This class is used internally to log all stdout lines into a file
+	Reads the lines of a log written by a LogWriter, in any format and
+	compression. Using the index of the framed logs, the reading can
+	start from the block of a given time without reading the ones before.
 	"""
 
 	def __init__(self, filename):
 		"""
+		Open the given log, reading its header and index
+		"""
+		self.filename = filename
+		self.framed = (FORMATS['framed'] + ".") in (os.path.basename(filename) + ".")
+		self.started = None
+		self.offset = 0
+		self.index = []
+		if not self.framed:
+			return
+
+		# Read header
+		f = self.open()
+		try:
+			head = f.read( len(MAGIC) + HEADER.size )
+			if not head.startswith(MAGIC) or (len(head) < len(MAGIC) + HEADER.size):
+				raise ValueError("The output %s is not a framed log" % filename)
+			self.started = HEADER.unpack( head[len(MAGIC):] )[0]
+		finally:
+			f.close()
+
+		# Read index, ignoring the entry of an interrupted write
+		if os.path.isfile(filename + ".idx"):
+			with open( filename + ".idx", "rb" ) as f:
+				data = f.read()
+			for i in range(0, len(data) - INDEX.size + 1, INDEX.size):
+				self.index.append( INDEX.unpack( data[i:i+INDEX.size] ) )
+		if self.index:
+			self.offset = self.index[0][2]
+
+	def open(self, offset=0):
+		"""
+		Open the log for reading from the block at the given offset
+		"""
+		f = open( self.filename, "rb" )
+		f.seek( offset )
+		if self.filename.endswith( COMPRESSIONS['gzip'] ):
+			return _Decompressed( f, gzip.GzipFile(fileobj=f, mode="rb") )
+		elif self.filename.endswith( COMPRESSIONS['lzma'] ):
+			if lzma is None:
+				f.close()
+				raise AssertionError("The lzma output compression is not available")
+			return _Decompressed( f, lzma.LZMAFile(f) )
+		return f
+
+	def seek(self, t):
+		"""
+		Return the (line, offset) of the last block that starts before
+		the given time, or the first block if there is none
+		"""
+		line, offset = 0, self.offset
+		if self.started is None:
+			return (line, offset)
+		us = (t - self.started) * 1000000
+		for l, u, o in self.index:
+			if u > us:
+				break
+			line, offset = l, o
+		return (line, offset)
+
+	def lines(self, since=None):
+		"""
+		Yield a (time, channel, line) tuple for every line, starting from
+		the block of the given time if given. The plain logs have no time,
+		so it is None and the channel is always 'stdout'.
+		"""
+		if not self.framed:
+			for line in self.text():
+				yield (None, CHANNELS[0], line)
+			return
+
+		# Start from the block of the given time, or right after the header
+		offset = self.offset
+		if since is not None:
+			offset = self.seek( since )[1]
+		f = self.open( offset )
+		try:
+			if not self.index:
+				f.read( len(MAGIC) + HEADER.size )
+			while True:
+				head = f.read( FRAME.size )
+				if len(head) < FRAME.size:
+					break
+				us, size, channel = FRAME.unpack( head )
+				line = f.read( size )
+				if len(line) < size:
+					break
+				t = self.started + us / 1000000.0
+				if (since is not None) and (t < since):
+					continue
+				if not isinstance(line, str):
+					line = line.decode("utf-8", "replace")
+				yield (t, CHANNELS[channel] if channel < len(CHANNELS) else str(channel), line)
+		except _TRUNCATED as e:
+			logging.getLogger("logpipe").warn("The output %s is truncated (%s)" % (self.filename, str(e)))
+		finally:
+			f.close()
+
+	def text(self):
+		"""
+		Yield the lines of a plain log
+		"""
+		f = self.open()
+		try:
+			for line in f:
+				if not isinstance(line, str):
+					line = line.decode("utf-8", "replace")
+				if line.endswith("\n"):
+					line = line[:-1]
+				yield line
+		except _TRUNCATED as e:
+			logging.getLogger("logpipe").warn("The output %s is truncated (%s)" % (self.filename, str(e)))
+		finally:
+			f.close()
+
+class _Decompressed(object):
+	"""
+	A decompressed view of a file, that also closes the file
+	"""
+
+	def __init__(self, f, view):
+		"""
+		Wrap the given decompressed view of the given file
+		"""
+		self.f = f
+		self.view = view
+
+	def read(self, size=-1):
+		"""
+		Read decompressed data
+		"""
+		return self.view.read( size )
+
+	def __iter__(self):
+		"""
+		Iterate over the decompressed lines
+		"""
+		return iter(self.view)
+
+	def close(self):
+		"""
+		Close the view and the file
+		"""
+		self.view.close()
+		self.f.close()
+
+class LogPipe(PipeListener):
+	"""
+	This class is used internally to log all stdout lines into a file,
+	and the stderr lines as well in framed logs
+	"""
+
+	def __init__(self, filename, format="plain", compression="none", interval=1.0, durability="flush"):
+		"""
+		Open a LogWriter on the given filename
 		"""
 		PipeListener.__init__(self)
-		self.fd = open(filename, "w")
+		self.writer = LogWriter( filename, format, compression, interval, durability )
+
+	def open(self, filename):
+		"""
+		Continue logging in the given filename, with the same writer
+		"""
+		self.writer.open( filename )
 
 	def got_stdout(self, line):
 		"""
-		Match the specified line against our configuration
+		Queue the line for writing
 		"""
-		self.fd.write("%s\n" % line)
+		self.writer.write( line, 0 )
+
+	def framed(self):
+		"""
+		Check if the lines are written in a framed log
+		"""
+		return self.writer.framed
+
+	def got_stderr(self, line):
+		"""
+		Queue the line for writing, if the log keeps the channels
+		"""
+		if self.writer.framed:
+			self.writer.write( line, 1 )
 
 	def got_eof(self):
 		"""
-		Process end of stream
+		Process end of stream, writing the pending lines
 		"""
-		self.fd.close()
+		self.writer.flush()
+
+	def close(self):
+		"""
+		Write the pending lines and close the log
+		"""
+		self.writer.close()
+
+def read_log(filename, since=None):
+	"""
+	Read the lines kept by a LogPipe, yielding a (timestamp, channel, line)
+	tuple for every line (see LogReader.lines)
+	"""
+	return LogReader( filename ).lines( since )
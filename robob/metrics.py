@@ -1,8 +1,10 @@
 
 import logging
-import time
+import threading
 
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from robob.util import time2sec, monotime
+from robob.stats import SteadyState
 from robob.factories import aggregateFactory
 
 #: SI prefix metric (ex. 10^3->k, 10^6->M)
@@ -11,6 +13,32 @@ METRIC_SI = 1
 #: IEC prefix metric (ex. 1024->k, 1024^2->M)
 METRIC_IEC = 2
 
+#: Prefixes of values larger than 1
+PREFIX_LARGE = [ 'k','M','G','T','P','E' ]
+
+#: Prefixes of values smaller than 1
+PREFIX_SMALL = [ 'm','u','n','p','f','a' ]
+
+#: Timestamps used by the current thread instead of the current time
+_CLOCK = threading.local()
+
+def set_clock( t ):
+	"""
+	Use the given timestamp for the values collected by the current thread
+	(ex. when replaying captured output), or the current time if None
+	"""
+	_CLOCK.t = t
+
+def now():
+	"""
+	Return the timestamp of the values collected by the current thread,
+	from a monotonic clock unless it was set with set_clock()
+	"""
+	t = getattr(_CLOCK, 't', None)
+	if t is None:
+		return monotime()
+	return t
+
 def _apply_prefix( value, base, prefixes ):
 	"""
 	Test what's the maximum prefix we can apply to the specified
@@ -52,24 +80,23 @@ def summarize( results ):
 	# Metrics are always the same, so just get the first ones
 	ans.metrics = results[0].metrics
 	ans.values = [0] * len(results[0].values)
+	ans.approx = [False] * len(results[0].values)
 
-	# Summarize values
+	# Summarize values, skipping the missing ones (ex. the bounds
+	# of a steady window that was not found)
+	counts = [0] * len(ans.values)
 	for r in results:
 		i = 0
 		for a,b in zip(ans.values, r.values):
-			if a is None and b is None:
-				ans.values[i] = None
-			elif a is None:
-				ans.values[i] = b+b
-			elif b is None:
-				ans.values[i] = a+a
-			else:
+			if r.approx[i]:
+				ans.approx[i] = True
+			if b is not None:
 				ans.values[i] = a+b
+				counts[i] += 1
 			i += 1
 
 	# Average
-	num = len(results)
-	ans.values = [ x / num for x in ans.values ]
+	ans.values = [ x / float(n) if n else None for x, n in zip(ans.values, counts) ]
 
 	# Return results
 	return ans
@@ -98,6 +125,30 @@ class MetricAggregator(object):
 		"""
 		return []
 
+	def summarize(self, total):
+		"""
+		Run aggregator over the totals (a MetricBucket) of a series whose
+		raw values were not all retained. Return None if the values of
+		this aggregator cannot be calculated exactly from the totals.
+		"""
+		return None
+
+	def collect_buckets(self, buckets):
+		"""
+		Run aggregator over the time-bucketed values of a series whose
+		raw values were not all retained. Return None if this aggregator
+		cannot approximate its values from buckets.
+		"""
+		return None
+
+	def collect_columns(self, t, v):
+		"""
+		Run aggregator over the columns of timestamps (relative to the
+		reset of the metric) and numbers of a series (see MetricColumns).
+		Return None if this aggregator needs the values themselves.
+		"""
+		return None
+
 	def titles(self):
 		"""
 		Return the title suffixes for the values returned by
@@ -110,11 +161,13 @@ class MetricValue(object):
 	A value with a timestamp used in the timeseries
 	"""
 
+	__slots__ = ( 't', 'v' )
+
 	def __init__(self, value):
 		"""
 		Keep value and timestamp
 		"""
-		self.t = time.time()
+		self.t = now()
 		self.v = value
 
 	def number(self):
@@ -132,6 +185,296 @@ class MetricValue(object):
 		except ValueError:
 			return 0.0
 
+class MetricBucket(object):
+	"""
+	Pre-aggregated count, sum, minimum and maximum of the values
+	that were collected within a time bucket
+	"""
+
+	__slots__ = ( 't', 'count', 'sum', 'min', 'max' )
+
+	def __init__(self, t):
+		"""
+		Initialize an empty bucket starting at the given time
+		"""
+		self.t = t
+		self.count = 0
+		self.sum = 0
+		self.min = None
+		self.max = None
+
+	def add(self, n):
+		"""
+		Include the given number in the bucket
+		"""
+		self.count += 1
+		self.sum += n
+		if self.min is None or n < self.min:
+			self.min = n
+		if self.max is None or n > self.max:
+			self.max = n
+
+	def merge(self, bucket):
+		"""
+		Include the contents of another bucket in this one
+		"""
+		if not bucket.count:
+			return
+		self.count += bucket.count
+		self.sum += bucket.sum
+		if self.min is None or bucket.min < self.min:
+			self.min = bucket.min
+		if self.max is None or bucket.max > self.max:
+			self.max = bucket.max
+
+class MetricSeries(object):
+	"""
+	The time series of a metric, optionally bounded by a retention
+	policy: a ring buffer of raw values and pre-aggregated time buckets.
+	"""
+
+	#: How many raw values to keep when only time buckets are defined
+	BUCKET_POINTS = 1000
+
+	def __init__(self, points=None, bucket=None, buckets=None, t=None):
+		"""
+		Initialize an empty series
+		"""
+		if bucket and (points is None):
+			points = self.BUCKET_POINTS
+		self.points = deque(maxlen=points)
+		self.bucket = bucket
+		self.buckets = deque(maxlen=buckets)
+		self.reset(t)
+
+	def reset(self, t=None):
+		"""
+		Drop all values, keeping the same series object so that
+		bound handles to it remain valid
+		"""
+		self.points.clear()
+		self.buckets.clear()
+		self.dropped = 0
+		self.droppedBuckets = 0
+		self.origin = now() if t is None else t
+
+		# Totals are tracked only if values can be dropped
+		self.total = None
+		if self.points.maxlen or self.bucket:
+			self.total = MetricBucket(self.origin)
+
+	def __len__(self):
+		"""
+		Return the number of retained raw values
+		"""
+		return len(self.points)
+
+	def __iter__(self):
+		"""
+		Iterate over the retained raw values
+		"""
+		return iter(self.points)
+
+	def complete(self):
+		"""
+		Check if all the raw values of the series are retained
+		"""
+		return self.dropped == 0
+
+	def merge(self, series):
+		"""
+		Merge the given series into a new series with the same retention
+		policy as this one. Values are merged in timestamp order, with ties
+		kept in the order of the given series.
+		"""
+		ans = MetricSeries( self.points.maxlen, self.bucket, self.buckets.maxlen, self.origin )
+
+		# Merge raw values (snapshots are taken with list() since
+		# the series might still be written by their streams)
+		points = []
+		for s in series:
+			points += list(s.points)
+			ans.dropped += s.dropped
+		points.sort( key=lambda v: v.t )
+		ans.points.extend( points )
+		ans.dropped += len(points) - len(ans.points)
+
+		# Merge totals and buckets
+		if ans.total is not None:
+			buckets = {}
+			for s in series:
+				ans.total.merge( s.total )
+				ans.droppedBuckets += s.droppedBuckets
+				for b in list(s.buckets):
+					if not b.t in buckets:
+						buckets[b.t] = MetricBucket(b.t)
+					buckets[b.t].merge( b )
+			for t in sorted(buckets):
+				if ans.buckets.maxlen is not None and len(ans.buckets) == ans.buckets.maxlen:
+					ans.droppedBuckets += 1
+				ans.buckets.append( buckets[t] )
+
+		# Return merged series
+		return ans
+
+	def append(self, value):
+		"""
+		Add a value in the time series
+		"""
+		v = MetricValue(value)
+
+		# Account for the value about to fall off the ring buffer
+		points = self.points
+		if points.maxlen is not None and len(points) == points.maxlen:
+			self.dropped += 1
+		points.append(v)
+
+		# Pre-aggregate if we have a retention policy
+		if self.total is None:
+			return
+		n = v.number()
+		self.total.add(n)
+
+		# Update time bucket
+		if self.bucket:
+			t = self.origin + int((v.t - self.origin) / self.bucket) * self.bucket
+			buckets = self.buckets
+			if not buckets or buckets[-1].t != t:
+				if buckets.maxlen is not None and len(buckets) == buckets.maxlen:
+					self.droppedBuckets += 1
+				buckets.append( MetricBucket(t) )
+			buckets[-1].add(n)
+
+class MetricColumns(object):
+	"""
+	A read-only series backed by columns of timestamps (relative to its
+	origin) and numbers, like the arrays loaded by a SeriesReader. The
+	aggregators that support it run over the columns, and the rest read
+	the values one by one, without keeping an object for every value.
+	"""
+
+	def __init__(self, t, v, origin, dropped=0):
+		"""
+		Wrap the given columns
+		"""
+		self.t = t
+		self.v = v
+		self.origin = origin
+		self.dropped = dropped
+		self.points = _ColumnPoints( t, v, origin )
+
+		# Totals and buckets are not kept
+		self.total = None
+		self.buckets = deque()
+		self.droppedBuckets = 0
+
+	def __len__(self):
+		"""
+		Return the number of values
+		"""
+		return len(self.v)
+
+	def __iter__(self):
+		"""
+		Iterate over the values
+		"""
+		return iter(self.points)
+
+	def complete(self):
+		"""
+		Check if all the values of the series were kept
+		"""
+		return self.dropped == 0
+
+	def slice(self, start, end):
+		"""
+		Return the columns of the given range of values
+		"""
+		return MetricColumns( self.t[start:end], self.v[start:end], self.origin, self.dropped )
+
+class _ColumnPoints(object):
+	"""
+	A sequence of MetricValue over columns, created when accessed
+	"""
+
+	def __init__(self, t, v, origin):
+		"""
+		Wrap the given columns
+		"""
+		self.t = t
+		self.v = v
+		self.origin = origin
+
+	def value(self, i):
+		"""
+		Create the MetricValue at the given index
+		"""
+		x = MetricValue.__new__( MetricValue )
+		x.t = self.origin + self.t[i]
+		x.v = self.v[i]
+		return x
+
+	def __len__(self):
+		"""
+		Return the number of values
+		"""
+		return len(self.v)
+
+	def __getitem__(self, i):
+		"""
+		Return the value at the given index, or the values of a slice
+		"""
+		if isinstance(i, slice):
+			return _ColumnPoints( self.t[i], self.v[i], self.origin )
+		if i < 0:
+			i += len(self.v)
+		if (i < 0) or (i >= len(self.v)):
+			raise IndexError(i)
+		return self.value( i )
+
+	def __iter__(self):
+		"""
+		Iterate over the values
+		"""
+		for i in range(0, len(self.v)):
+			yield self.value( i )
+
+class MetricWindow(object):
+	"""
+	Formats the bounds of the steady-state window of a metric, in
+	seconds since the beginning of the series, which are None if
+	no steady window was found
+	"""
+
+	#: The bounds are not measured values
+	measured = False
+
+	def __init__(self, metric):
+		"""
+		Link to the metric
+		"""
+		self.metric = metric
+		self.name = "%s.steady" % metric.name
+
+	def format(self, value, withunits=False):
+		"""
+		Human-readable formatting of the given window bound
+		"""
+		if value is None:
+			return "(None)"
+		if withunits:
+			return "%.2f s" % value
+		return "%.2f" % value
+
+	def parse(self, text):
+		"""
+		Parse a window bound rendered by format() back to a number
+		"""
+		text = text.strip()
+		if not text or (text == "(None)"):
+			return None
+		return float(text.split(" ", 1)[0])
+
 class Metric(object):
 	"""
 	A single metric on the metrics array
@@ -146,7 +489,7 @@ class Metric(object):
 		self.name = config['name']
 		self.title = self.name
 		self.initial = 0
-		self.series = []
+		self.series = None
 		self.units = ""
 		self.prefix = 0
 		self.scale = 1.0
@@ -154,6 +497,8 @@ class Metric(object):
 		self.aggregators = []
 		self.resetTime = 0
 		self.unitsInValues = False
+		self.retention = {}
+		self.steady = None
 
 		# Update optional
 		if 'title' in config:
@@ -176,6 +521,19 @@ class Metric(object):
 			self.scale = float(config['scale'])
 		if 'dec' in config:
 			self.decimals = int(config['dec'])
+		if 'retention' in config:
+			retention = config['retention']
+			if not isinstance(retention, dict):
+				retention = { "points": retention }
+			if 'points' in retention:
+				self.retention['points'] = int(retention['points'])
+			if 'bucket' in retention:
+				self.retention['bucket'] = time2sec(retention['bucket'])
+			if 'buckets' in retention:
+				self.retention['buckets'] = int(retention['buckets'])
+		if 'steady' in config and config['steady']:
+			self.steady = SteadyState( config['steady'] )
+			self.window = MetricWindow( self )
 		if 'aggregate' in config:
 			aggregate = config['aggregate']
 			if isinstance(aggregate, str):
@@ -201,14 +559,24 @@ class Metric(object):
 		"""
 		Add a value in the time series
 		"""
-		self.series.append( MetricValue(value) )
+		self.series.append( value )
 
 	def reset(self):
 		"""
 		Reset to default
 		"""
-		self.series = []
-		self.resetTime = time.time()
+		self.resetTime = now()
+		if self.series is None:
+			self.series = self.createSeries()
+		else:
+			self.series.reset( self.resetTime )
+
+	def createSeries(self):
+		"""
+		Create an empty series that follows the retention policy of
+		this metric and is aligned to the last reset time
+		"""
+		return MetricSeries( t=self.resetTime, **self.retention )
 
 	def format(self, value, withunits=False):
 		"""
@@ -232,12 +600,12 @@ class Metric(object):
 			# Apply prefix
 			if self.prefix == METRIC_SI:
 				if v < 1:
-					(v, sf) = _apply_prefix( v, 0.001, [ 'm','u','n','p','f','a' ] )
+					(v, sf) = _apply_prefix( v, 0.001, PREFIX_SMALL )
 				else:
-					(v, sf) = _apply_prefix( v, 1000, [ 'k','M','G','T','P','E' ] )
+					(v, sf) = _apply_prefix( v, 1000, PREFIX_LARGE )
 				u = sf + u
 			elif self.prefix == METRIC_IEC:
-				(v, sf) = _apply_prefix( v, 1024, [ 'k','M','G','T','P','E' ] )
+				(v, sf) = _apply_prefix( v, 1024, PREFIX_LARGE )
 				u = sf + u
 
 			# Add space
@@ -249,6 +617,36 @@ class Metric(object):
 		# Return value with units
 		return s + u
 
+	def parse(self, text):
+		"""
+		Parse a value rendered by format() back to a number. Since the
+		rendered values are rounded, the parsed value is approximate.
+		"""
+
+		# Handle none
+		text = text.strip()
+		if not text or (text == "(None)"):
+			return None
+
+		# Split number and units
+		parts = text.split(" ", 1)
+		v = float(parts[0])
+
+		# Undo the prefix
+		if (len(parts) > 1) and self.prefix:
+			sf = parts[1][0:len(parts[1])-len(self.units)]
+			if self.prefix == METRIC_SI:
+				if sf in PREFIX_LARGE:
+					v *= pow(1000, PREFIX_LARGE.index(sf))
+				elif sf in PREFIX_SMALL:
+					v *= pow(0.001, PREFIX_SMALL.index(sf))
+			elif self.prefix == METRIC_IEC:
+				if sf in PREFIX_LARGE:
+					v *= pow(1024, PREFIX_LARGE.index(sf))
+
+		# Undo the scale
+		return v / self.scale
+
 	def titles(self):
 		"""
 		Return the titles fo the values returned by this metric
@@ -272,6 +670,11 @@ class Metric(object):
 					else:
 						titles.append( "%s %s" % (self.title, t) )
 
+		# Include steady window bounds
+		if self.steady:
+			titles.append( "%s (Steady from) [s]" % self.title )
+			titles.append( "%s (Steady to) [s]" % self.title )
+
 		# Return titles
 		return titles
 
@@ -279,14 +682,118 @@ class Metric(object):
 		"""
 		Return metric values as collected from the aggregators
 		"""
+		return self.collect()[0]
+
+	def collect(self, series=None):
+		"""
+		Collect the values of the aggregators over the given series
+		(or the current one) and return a tuple with the values and
+		a list of flags that mark approximated values
+		"""
+		if series is None:
+			series = self.series
+		if isinstance(series, MetricColumns):
+			return self.collectColumns( series )
 		values = []
+		approx = []
+
+		# Restrict the values to the steady-state window, if found
+		points = series.points
+		if self.steady:
+			points = list(points)
+			window = [ None, None ]
+			found = self.steady.detect( [ v.number() for v in points ] )
+			if found:
+				(start, end) = found
+				window = [ points[start].t - series.origin, points[end-1].t - series.origin ]
+				points = points[start:end]
 
 		# Create values from aggregators
 		for a in self.aggregators:
-			values += a.collect( self.series )
+
+			# With steady-state detection, only the (retained)
+			# values within the steady window are aggregated
+			if self.steady:
+				ans = a.collect( points )
+				values += ans
+				approx += [ not series.complete() ] * len(ans)
+				continue
+
+			# All values are retained, so results are exact
+			if series.complete():
+				ans = a.collect( points )
+				values += ans
+				approx += [ False ] * len(ans)
+				continue
+
+			# Otherwise try to use the exact totals
+			ans = a.summarize( series.total )
+			if ans is not None:
+				values += ans
+				approx += [ False ] * len(ans)
+				continue
+
+			# Or approximate using buckets or the retained values
+			ans = None
+			if series.buckets and not series.droppedBuckets:
+				ans = a.collect_buckets( series.buckets )
+			if ans is None:
+				ans = a.collect( points )
+			values += ans
+			approx += [ True ] * len(ans)
+
+		# Append the bounds of the steady window
+		if self.steady:
+			values += window
+			approx += [ False, False ]
+
+		# Return values
+		return (values, approx)
+
+	def collectColumns(self, columns):
+		"""
+		Collect the values of the aggregators over the given MetricColumns,
+		the same way as collect()
+		"""
+		values = []
+		approx = []
+
+		# Restrict the values to the steady-state window, if found
+		if self.steady:
+			window = [ None, None ]
+			found = self.steady.detect( columns.v )
+			if found:
+				(start, end) = found
+				window = [ columns.t[start], columns.t[end-1] ]
+				columns = columns.slice( start, end )
+
+		# Run the aggregators over the columns, or over the values
+		for a in self.aggregators:
+			ans = a.collect_columns( columns.t, columns.v )
+			if ans is None:
+				ans = a.collect( columns.points )
+			values += ans
+			approx += [ not columns.complete() ] * len(ans)
+
+		# Append the bounds of the steady window
+		if self.steady:
+			values += window
+			approx += [ False, False ]
 
 		# Return values
-		return values
+		return (values, approx)
+
+	def formatters(self):
+		"""
+		Return the objects that format each of the values returned
+		by this metric
+		"""
+		formatters = []
+		for a in self.aggregators:
+			formatters += [ self ] * len(a.titles())
+		if self.steady:
+			formatters += [ self.window, self.window ]
+		return formatters
 
 class MetricsResults(object):
 	"""
@@ -301,33 +808,90 @@ class MetricsResults(object):
 
 		self.values = []
 		self.metrics = []
+		self.approx = []
 
-	def updateFrom(self, metric):
+		# The series the values were collected from, by metric name,
+		# kept only until they are archived (see 'report.keep_series')
+		self.series = None
+
+	def updateFrom(self, metric, series=None):
 		"""
-		Update values of the specified metric
+		Update values of the specified metric, optionally
+		aggregating the given series instead of its own
 		"""
 
 		# Get aggregated values
-		values = list(metric.values())
+		(values, approx) = metric.collect( series )
 
-		# Update value and linked metric for it
-		for v in values:
+		# Update value and linked metric (formatter) for it
+		for v, a, f in zip(values, approx, metric.formatters()):
 			self.values.append( v )
-			self.metrics.append( metric )
+			self.approx.append( a )
+			self.metrics.append( f )
 
 	def render(self, withunits=False):
 		"""
-		Render the results to human-readable indicators
+		Render the results to human-readable indicators. Approximated
+		values are prefixed with '~'.
 		"""
 		results = []
 
 		# Iterate over values and render them
 		for i in range(0, len(self.values)):
-			results.append( self.metrics[i].format( self.values[i], withunits ) )
+			v = self.metrics[i].format( self.values[i], withunits )
+			if self.approx[i]:
+				v = "~" + v
+			results.append( v )
 
 		# Return results
 		return results
 
+class MetricsBuffer(object):
+	"""
+	An ingestion buffer that keeps the metric series updated by a single
+	stream. It is written only by the thread of that stream and merged with
+	the rest of the buffers when the results are collected.
+	"""
+
+	def __init__(self, metrics):
+		"""
+		Initialize a metrics buffer with a series for every metric
+		"""
+		self.metrics = metrics
+		self.series = OrderedDict()
+		for name, m in metrics.metrics.items():
+			self.series[name] = m.createSeries()
+
+	def reset(self):
+		"""
+		Reset all series, aligned to the reset time of their metrics
+		"""
+		for name, m in self.metrics.metrics.items():
+			self.series[name].reset( m.resetTime )
+
+	def update(self, name, value):
+		"""
+		Update the specified value to a metric
+		"""
+		handle = self.handle(name)
+		if handle is not None:
+			handle( value )
+
+	def handle(self, name):
+		"""
+		Return a function that appends a value directly to the series
+		of the specified metric, or None if the metric is unknown
+		"""
+
+		# Bind to the buffered series of the metric
+		series = self.series.get(name)
+		if series is not None:
+			return series.append
+
+		# Unknown metric
+		self.metrics.warnUnknown( name )
+		return None
+
 class Metrics(object):
 	"""
 	Metrics class is responsible for keeping track for metrics
@@ -339,6 +903,10 @@ class Metrics(object):
 		Initialize metrics object
 		"""
 		self.metrics = OrderedDict()
+		self.buffers = OrderedDict()
+		self.logger = logging.getLogger("metrics")
+		self.unknown = set()
+		self.keepSeries = False
 
 	def configure(self, config):
 		"""
@@ -349,25 +917,63 @@ class Metrics(object):
 		for m in config['metric']:
 			self.metrics[ m['name'] ] = Metric( m )
 
+		# Attach the series to the results only if they are archived
+		self.keepSeries = ('report.keep_series' in config)
+
 	def reset(self):
 		"""
-		Reset all metrics
+		Reset all metrics and their buffers
 		"""
 		for m in list(self.metrics.values()):
 			m.reset()
+		for b in list(self.buffers.values()):
+			b.reset()
+
+	def buffer(self, key):
+		"""
+		Return the ingestion buffer with the given key, creating it
+		if missing. Buffers are merged in the order they were created.
+		"""
+		if not key in self.buffers:
+			self.buffers[key] = MetricsBuffer( self )
+		return self.buffers[key]
 
 	def update(self, name, value):
 		"""
 		Update the specified value to a metric
 		"""
-		logger = logging.getLogger("metrics")
 
 		# Update the specified metric
-		if name in self.metrics:
-			logger.debug("Updating metric '%s' to '%s'" % (name, str(value)))
-			self.metrics[name].update( value )
+		metric = self.metrics.get(name)
+		if metric is not None:
+			if self.logger.isEnabledFor(logging.DEBUG):
+				self.logger.debug("Updating metric '%s' to '%s'" % (name, str(value)))
+			metric.update( value )
 		else:
-			logger.warn("Trying to update an unknown metric: '%s'" % name)
+			self.warnUnknown( name )
+
+	def handle(self, name):
+		"""
+		Return a function that appends a value directly to the series
+		of the specified metric, or None if the metric is unknown
+		"""
+
+		# Bind to the series of the metric
+		metric = self.metrics.get(name)
+		if metric is not None:
+			return metric.series.append
+
+		# Unknown metric
+		self.warnUnknown( name )
+		return None
+
+	def warnUnknown(self, name):
+		"""
+		Warn (once) about an update to an unknown metric
+		"""
+		if not name in self.unknown:
+			self.unknown.add( name )
+			self.logger.warn("Trying to update an unknown metric: '%s'" % name)
 
 	def titles(self):
 		"""
@@ -382,6 +988,52 @@ class Metrics(object):
 		# Return titles
 		return titles
 
+	def parse(self, rendered):
+		"""
+		Parse the values rendered by MetricsResults.render() back to
+		(approximate) results
+		"""
+		results = MetricsResults()
+
+		# Collect the formatters of all metrics
+		for m in list(self.metrics.values()):
+			results.metrics += m.formatters()
+		if len(rendered) != len(results.metrics):
+			raise ValueError("Expected %i values, got %i" % (len(results.metrics), len(rendered)))
+
+		# Parse every value
+		for f, text in zip(results.metrics, rendered):
+			approx = text.startswith("~")
+			if approx:
+				text = text[1:]
+			results.values.append( f.parse(text) )
+			results.approx.append( approx )
+
+		# Return resultset
+		return results
+
+	def load(self, values, approx=None):
+		"""
+		Rebuild the results with the given raw values and approximation
+		flags, as kept from MetricsResults.values and approx (ex. cached)
+		"""
+		results = MetricsResults()
+
+		# Collect the formatters of all metrics
+		for m in list(self.metrics.values()):
+			results.metrics += m.formatters()
+		if len(values) != len(results.metrics):
+			raise ValueError("Expected %i values, got %i" % (len(results.metrics), len(values)))
+
+		# Keep the values
+		results.values = list(values)
+		if approx is None:
+			approx = [ False ] * len(values)
+		results.approx = [ bool(a) for a in approx ]
+
+		# Return resultset
+		return results
+
 	def results(self):
 		"""
 		Collect current results in a result object
@@ -389,11 +1041,27 @@ class Metrics(object):
 
 		# Create new metrics results using the specs from the metrics
 		results = MetricsResults()
+		series = self.series()
+		if self.keepSeries:
+			results.series = series
 
 		# Start aggregating results
-		for m in list(self.metrics.values()):
-			results.updateFrom( m )
+		for name, m in list(self.metrics.items()):
+			results.updateFrom( m, series[name] )
 
 		# Return resultset
 		return results
 
+	def series(self):
+		"""
+		Return the series of every metric, merged with the buffered ones
+		"""
+		ans = OrderedDict()
+		buffers = list(self.buffers.values())
+		for name, m in list(self.metrics.items()):
+			series = m.series
+			if buffers:
+				series = series.merge( [ series ] + [ b.series[name] for b in buffers ] )
+			ans[name] = series
+		return ans
+
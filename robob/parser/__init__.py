@@ -2,6 +2,12 @@
 from robob.pipe import PipeListener
 from robob.component import ComponentBase
 
+def _discard(value):
+	"""
+	Handle for metric values that should not be collected
+	"""
+	pass
+
 class ParserBase(ComponentBase, PipeListener):
 	"""
 	Base class for implementing stream output parser
@@ -18,6 +24,7 @@ class ParserBase(ComponentBase, PipeListener):
 		self._metrics = metrics
 		self._alias = {}
 		self._filter = None
+		self._handles = {}
 
 	def got_stdout(self, line):
 		"""
@@ -31,6 +38,12 @@ class ParserBase(ComponentBase, PipeListener):
 		"""
 		pass
 
+	def got_reset(self):
+		"""
+		[Public] Reset the parser before the stream is run again
+		"""
+		self.reset()
+
 	def reset(self):
 		"""
 		[Public] Reset the parser for a new stream
@@ -42,26 +55,44 @@ class ParserBase(ComponentBase, PipeListener):
 		[Public] Update alias mapping
 		"""
 		self._alias = aliases
+		self._handles = {}
 
 	def set_filter(self, metrics):
 		"""
 		[Public] Update metrics filter
 		"""
+		if isinstance(metrics, str):
+			metrics = [ metrics ]
+		if not metrics is None:
+			metrics = frozenset(metrics)
 		self._filter = metrics
+		self._handles = {}
 
-	def update(self, metric, value):
+	def bind(self, metric):
 		"""
-		[Private] Update the value of the specified metric
+		[Private] Resolve the filter, alias and metric of the specified
+		name once, into a handle that accepts the metric values
 		"""
 
-		# Skip metrics in filter
+		# Metrics in filter are discarded
 		if not self._filter is None and not metric in self._filter:
-			return
+			handle = _discard
 
-		# Replace alias if found
-		if metric in self._alias:
-			metric = self._alias[metric]
+		# Otherwise bind to the aliased metric
+		else:
+			handle = self._metrics.handle( self._alias.get(metric, metric) )
+			if handle is None:
+				handle = _discard
 
-		# Forward to metrics
-		self._metrics.update( metric, value )
+		# Keep handle
+		self._handles[metric] = handle
+		return handle
 
+	def update(self, metric, value):
+		"""
+		[Private] Update the value of the specified metric
+		"""
+		handle = self._handles.get(metric)
+		if handle is None:
+			handle = self.bind(metric)
+		handle(value)
@@ -76,6 +76,14 @@ class Parser(ParserBase):
 		"""
 		self._commit()
 
+	def reset(self):
+		"""
+		Drop the data of the previous run
+		"""
+		ParserBase.reset(self)
+		self.matrix = {}
+		self.core_parsing = False
+
 	def _commit(self):
 		"""
 		Update metrics according to details
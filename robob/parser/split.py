@@ -120,5 +120,6 @@ class Parser(ParserBase):
 		"""
 		When reset, anchor lines to line #0
 		"""
+		ParserBase.reset(self)
 		self.line = 0
 
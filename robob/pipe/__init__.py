@@ -26,6 +26,12 @@ class PipeListener(object):
 		"""
 		pass
 
+	def got_reset(self):
+		"""
+		Reset the listener state before the pipe is run again
+		"""
+		pass
+
 class PipeExpect(object):
 	"""
 	A pipe expect entry
@@ -185,6 +191,19 @@ class PipeBase(ComponentBase):
 		for p in self.pipes:
 			p.pipe_close()
 
+	def pipe_reset(self):
+		"""
+		Reset the state of the pipe before it is run again
+		"""
+
+		# Trigger to listeners
+		for l in self.listeners:
+			l.got_reset()
+
+		# Forward to children
+		for p in self.pipes:
+			p.pipe_reset()
+
 	def plug(self, pipe):
 		"""
 		Plug a pipe in the this
@@ -200,3 +219,9 @@ class PipeBase(ComponentBase):
 		if not isinstance(listener, PipeListener):
 			raise AssertionError("The given listener object is not instance of PipeListener")
 		self.listeners.append(listener)
+
+	def unlisten(self, listener):
+		"""
+		Stop listening for input events
+		"""
+		self.listeners.remove(listener)
@@ -1,32 +1,55 @@
 
+import os
+import time
 import datetime
+import threading
 import logging
 from collections import OrderedDict
 
+from robob.util import time2sec
+from robob.writer import BufferedWriter
+from robob.series import SeriesArchive, SeriesReader
+from robob.metrics import Metrics, MetricsResults, summarize
+
 class Reporter(object):
 	"""
 	A class tha generates reports
 	"""
 
-	def __init__(self, filename, specs):
+	def __init__(self, filename, specs, store=None):
 		"""
 		Initialize a new test report, keeping the data in the output specified
+		and optionally the raw results in the given ResultStore
 		"""
 
 		self.fd = None
+		self.store = store
+		self.archive = None
 		self.testID = 0
 		self.specs = specs
 		self.filename = filename
-		self.iterations = int(specs.specs.get("test.iterations", 1))
 		self.testVariables = specs.getTestVariables()
 		self.testTitles = specs.getMetricTitles()
-		self.activeTest = []
-		self.summaryLines = []
 
-		self.in_iteration = False
-		self.in_test = False
-		self.cur_iterations = 0
-		self.ok_iterations = 0
+		# The summary lines are streamed to a side file until finalized
+		self.summaryFile = None
+
+		# Writing policy
+		self.interval = time2sec(specs.context.get("report.flush", 1))
+		self.durability = str(specs.context.get("report.durability", "flush"))
+		self.keepSeries = ('report.keep_series' in specs.context)
+
+		self.previousRows = {}
+		self.previousSummary = {}
+
+		# Tests not completely written yet, in the order they started
+		self.current = None
+		self.running = []
+		self.lock = threading.RLock()
+
+		# If True, the text of the tests is written as soon as it arrives,
+		# for schedulers that switch between the tests of one thread
+		self.interleaved = False
 
 		# Calculate maximum title width
 		self.testTitleWidth = 1
@@ -53,11 +76,11 @@ class Reporter(object):
 
 		# Reset properties
 		self.testID = 0
-		self.activeTest = []
+		self.current = None
 
 		# Open file descriptor
 		self.logger.info("Writing report to %s" % self.filename)
-		self.fd = open(self.filename, "w")
+		self.open("w")
 
 		# Write title & Columns
 		for k,v in self.notes.items():
@@ -66,8 +89,122 @@ class Reporter(object):
 		self.fd.write("\n")
 		self.fd.write("Test numbers\n")
 		self.fd.write("\n")
-		self.fd.write("Num,Iteration,Started,Ended,Status,%s,%s,Comment\n" % \
-			( ",".join(self.testVariables),  ",".join(self.testTitles) ) )
+		self.fd.write("%s\n" % self.header())
+
+		# Start a run in the store
+		if self.store:
+			self.store.start( self.filename, self.notes )
+
+	def open( self, mode ):
+		"""
+		Open the report, the side file of the summary lines and
+		the archive of the metric series, if they are kept
+		"""
+		self.fd = ReportWriter( self.filename, mode, self.interval, self.durability )
+		self.summaryFile = ReportWriter( self.summaryName(), "w", self.interval, self.durability )
+		if self.keepSeries:
+			self.archive = SeriesArchive( self.seriesName() )
+
+	def seriesName( self ):
+		"""
+		Return the name of the directory of the metric series
+		"""
+		name = os.path.basename( self.filename )
+		if name.endswith(".csv"):
+			name = name[0:-4]
+		return os.path.join( self.specs.context['report.keep_series'], name )
+
+	def summaryName( self ):
+		"""
+		Return the name of the side file of the summary lines
+		"""
+		return "%s.summary" % self.filename
+
+	def header( self ):
+		"""
+		Return the columns of the test numbers
+		"""
+		return "Num,Iteration,Started,Ended,Status,%s,%s,Comment" % \
+			( ",".join(self.testVariables),  ",".join(self.testTitles) )
+
+	def resume( self, report ):
+		"""
+		Continue the given report (a ReportFile), keeping only the completed
+		iterations of the previous run. The report is rewritten atomically
+		and the new iterations are appended to it.
+		"""
+
+		# Make sure it's the same specs
+		if report.header != self.header():
+			raise ValueError("The columns of %s do not match the ones of the specs" % report.filename)
+
+		# Reset properties
+		self.testID = 0
+		self.current = None
+		self.filename = report.filename
+
+		# Collect the completed iterations and the summaries of the tests
+		self.previousRows = {}
+		self.previousSummary = {}
+		rows = []
+		for l in report.rows:
+			try:
+				f = report.fields(l)
+			except ValueError:
+				continue # Iteration that never ended
+			if f[4] != "Completed":
+				continue
+			num = int(f[0])
+			if not num in self.previousRows:
+				self.previousRows[num] = OrderedDict()
+			self.previousRows[num][ int(f[1].split(" ")[0]) ] = f
+			rows.append(l)
+		for l in report.summary:
+			self.previousSummary[ _num(l) ] = l
+
+		# Pick the summaries of a run that never finalized
+		if os.path.isfile(self.summaryName()):
+			with open(self.summaryName(), "r") as f:
+				for l in f.read().split("\n"):
+					if l:
+						self.previousSummary[ _num(l) ] = l
+
+		# Rewrite the report with only the completed iterations
+		self.logger.info("Resuming report %s (%i completed iterations)" % (self.filename, len(rows)))
+		tmpname = "%s.tmp" % self.filename
+		with open(tmpname, "w") as f:
+			for n in report.notes:
+				f.write("%s\n" % n)
+			f.write("\n")
+			f.write("Test numbers\n")
+			f.write("\n")
+			f.write("%s\n" % report.header)
+			for l in rows:
+				f.write("%s\n" % l)
+		os.rename( tmpname, self.filename )
+
+		# Append the new iterations
+		self.open("a")
+
+		# Continue the run in the store
+		if self.store:
+			self.store.start( self.filename, self.notes, True )
+
+	def completed( self, num ):
+		"""
+		Return the rendered values of the iterations of the given test
+		that were completed in the previous run, as a dictionary of
+		iteration number to values
+		"""
+		ans = OrderedDict()
+		if not num in self.previousRows:
+			return ans
+
+		# Pick the values out of the row fields
+		first = 5 + len(self.testVariables)
+		for i, f in self.previousRows[num].items():
+			ans[i] = f[ first:first+len(self.testTitles) ]
+		return ans
 
 	def close(self):
 		"""
@@ -79,10 +216,24 @@ class Reporter(object):
 			self.fd.close()
 			self.fd = None
 
+		# Keep the side file of a report that was not finalized
+		if self.summaryFile:
+			self.summaryFile.close()
+			self.summaryFile = None
+
+		# Close store and series
+		if self.store:
+			self.store.close()
+		if self.archive:
+			self.archive.close()
+			self.archive = None
+
 	def finalize(self):
 		"""
 		Finalize report
 		"""
+		if self.summaryFile is None:
+			return
 
 		self.logger.info("Finalizing report")
 
@@ -92,12 +243,186 @@ class Reporter(object):
 		self.fd.write("Num,Started,Ended,Iterations,Successful,%s,%s,Comment\n" % \
 			( ",".join(self.testVariables),  ",".join(self.testTitles) ) )
 
-		# Write summarization lines
-		for l in self.summaryLines:
+		# Write the text of all tests and their summarization lines
+		with self.lock:
+			for test in self.running:
+				test.ended = True
+			self.flush()
+			self.summaryFile.close()
+			self.summaryFile = None
+
+		# Move the lines of the side file to the report
+		with open(self.summaryName(), "r") as f:
+			lines = [ "%s\n" % l for l in f.read().split("\n") if l ]
+		for l in sorted(lines, key=_num):
 			self.fd.write(l)
 
 		# Flush
 		self.fd.flush()
+		os.remove( self.summaryName() )
+		if self.store:
+			self.store.finish()
+
+	def write( self, test, text ):
+		"""
+		Write text of the given test. The text of the tests is written in
+		the order they were started, so the text of a test is buffered
+		until all the tests started before it have ended, unless the
+		reporter is interleaved.
+		"""
+		with self.lock:
+			if self.interleaved or (self.running and (self.running[0] is test)):
+				self.fd.write(text)
+			else:
+				test.buffer.append(text)
+
+	def flush( self ):
+		"""
+		Write the buffered text of the tests whose turn has come
+		"""
+		while self.running:
+			test = self.running[0]
+			if test.buffer:
+				self.fd.write("".join(test.buffer))
+				test.buffer = []
+			if not test.ended:
+				break
+			self.running.pop(0)
+
+	def test_started( self, test ):
+		"""
+		Keep track of a new test
+		"""
+		with self.lock:
+			self.running.append(test)
+
+	def test_ended( self, test, summary ):
+		"""
+		Keep the summary of the given test and write the buffered
+		text of the tests that can now be written
+		"""
+		with self.lock:
+			test.ended = True
+			if summary and self.summaryFile:
+				self.summaryFile.write(summary)
+			self.flush()
+
+	def test_start( self, testContext, iterations=None, num=None ):
+		"""
+		Log the start of a groupped test, optionally overriding the
+		(maximum) number of iterations defined in the test specs and
+		the test number. Returns the TestReport of the test, that can
+		be used instead of the reporter for concurrent tests.
+		"""
+
+		with self.lock:
+
+			# Calculate test number
+			if num is None:
+				num = self.testID + 1
+			self.testID = num
+
+			# Start the test report
+			self.current = TestReport( self, testContext, iterations, num )
+			return self.current
+
+	def iteration_start( self, iteration ):
+		"""
+		Log the start of an iteration of the current test
+		"""
+		self.current.iteration_start( iteration )
+
+	def iteration_end( self, results, status="Completed", comment="" ):
+		"""
+		Log the completion of an iteration of the current test
+		"""
+		self.current.iteration_end( results, status, comment )
+
+	def iteration_cached( self, iteration, cached, results ):
+		"""
+		Log an iteration of the current test taken from the cache
+		"""
+		self.current.iteration_cached( iteration, cached, results )
+
+	def test_end( self, results, comment="" ):
+		"""
+		Log the end of the current test
+		"""
+		self.current.test_end( results, comment )
+
+	def interrupt(self, results, reason="Interrupted by the user"):
+		"""
+		User interrupted the test, log the action
+		"""
+
+		# Interrupt all running tests, using the results for the current one
+		for test in list(self.running):
+			if not test.ended:
+				if test is self.current:
+					test.interrupt( results, reason )
+				else:
+					test.interrupt( None, reason )
+
+		# Finalize
+		self.finalize()
+
+class TestReport(object):
+	"""
+	The report of a single test, that can run concurrently with others
+	"""
+
+	def __init__(self, reporter, testContext, iterations, num):
+		"""
+		Log the start of a groupped test
+		"""
+
+		# Reset iterations
+		if iterations is None:
+			iterations = int(testContext.get("test.iterations", 1))
+		self.reporter = reporter
+		self.iterations = iterations
+		self.cur_iterations = 0
+		self.ok_iterations = 0
+
+		# Prepare properties
+		self.testID = num
+		self.activeTest = [ str(testContext[x]) for x in reporter.testVariables ]
+		self.in_test = True
+		self.in_iteration = False
+		self.ended = False
+		self.buffer = []
+
+		self.started = None
+		self.iteration = None
+		self.lastIteration = None
+
+		# Account for the iterations completed in the previous run
+		self.previousIterations = 0
+		if self.testID in reporter.previousRows:
+			for f in reporter.previousRows[self.testID].values():
+				if f[ 5:5+len(reporter.testVariables) ] != self.activeTest:
+					raise ValueError("Test %i was run with different test-case values in the resumed report" % self.testID)
+			self.previousIterations = len(reporter.previousRows[self.testID])
+		self.cur_iterations = self.previousIterations
+		self.ok_iterations = self.previousIterations
+
+		# Keep for summary
+		self.testStarted = str(datetime.datetime.now())
+		self.summary = "%i,%s" % ( self.testID, self.testStarted )
+		reporter.test_started( self )
+
+	def write( self, text ):
+		"""
+		Write text to the report
+		"""
+		self.reporter.write( self, text )
+
+	def completed( self ):
+		"""
+		Return the rendered values of the iterations completed
+		in the previous run
+		"""
+		return self.reporter.completed( self.testID )
 
 	def iteration_start( self, iteration ):
 		"""
@@ -105,9 +430,10 @@ class Reporter(object):
 		"""
 
 		# Log the beginning of test and starting date
-		self.fd.write("%i,%i of %i,%s" % \
-			( self.testID, iteration, self.iterations, str(datetime.datetime.now()) ) )
-		self.fd.flush()
+		self.started = str(datetime.datetime.now())
+		self.iteration = iteration
+		self.write("%i,%i of %i,%s" % \
+			( self.testID, iteration, self.iterations, self.started ) )
 
 		# Enter iteration
 		self.in_iteration = True
@@ -117,11 +443,13 @@ class Reporter(object):
 		"""
 		Log the completion of a test
 		"""
+		reporter = self.reporter
 
 		# Write end and values
-		self.fd.write(",%s,%s,%s,%s,%s\n" % \
-			( str(datetime.datetime.now()), status, ",".join(self.activeTest), ",".join(results.render()), comment ) )
-		self.fd.flush()
+		ended = str(datetime.datetime.now())
+		values = results.render()
+		self.write(",%s,%s,%s,%s,%s\n" % \
+			( ended, status, ",".join(self.activeTest), ",".join(values), comment ) )
 
 		# Count successful iterations
 		if status == "Completed":
@@ -129,67 +457,354 @@ class Reporter(object):
 
 		# Exit iteration
 		self.in_iteration = False
+		self.lastIteration = { 'started': self.started, 'ended': ended, 'values': values,
+			'raw': list(results.values), 'approx': list(results.approx) }
+
+		# Keep the raw results and their series
+		if reporter.store:
+			reporter.store.iteration( self.testID, self.iteration, self.started, ended, status, comment, results )
+		if reporter.archive and (results.series is not None):
+			reporter.archive.store( self.testID, self.iteration, results.series, OrderedDict([
+				('started', self.started), ('ended', ended), ('status', status), ('comment', comment),
+				('variables', OrderedDict(zip(reporter.testVariables, self.activeTest)))
+			]) )
+		results.series = None
 
 		# Print values
 		rendered = results.render( True )
-		self.logger.info( "-" * (self.testTitleWidth + 20) )
-		for i in range(0, len(self.testTitles)):
-			self.logger.info(
-				(("%%%is : ") % self.testTitleWidth) % self.testTitles[i] + rendered[i]
+		reporter.logger.info( "-" * (reporter.testTitleWidth + 20) )
+		for i in range(0, len(reporter.testTitles)):
+			reporter.logger.info(
+				(("%%%is : ") % reporter.testTitleWidth) % reporter.testTitles[i] + rendered[i]
 			)
-		self.logger.info( "-" * (self.testTitleWidth + 20) )
+		reporter.logger.info( "-" * (reporter.testTitleWidth + 20) )
 
-	def test_start( self, testContext ):
+	def iteration_cached( self, iteration, cached, results ):
 		"""
-		Log the start of a groupped test
+		Log an iteration whose results were taken from the cache, as
+		stored from the lastIteration of a previous run, and restored
+		to the given results
 		"""
 
-		# Reset iterations
-		self.iterations = int(testContext.get("test.iterations", 1))
-		self.cur_iterations = 0
-		self.ok_iterations = 0
+		# Write the entire line
+		self.write("%i,%i of %i,%s,%s,%s,%s,%s,%s\n" % \
+			( self.testID, iteration, self.iterations, cached['started'], cached['ended'], "Completed", ",".join(self.activeTest), ",".join(results.render()), "Cached" ) )
 
-		# Prepare properties
-		self.testID += 1
-		self.activeTest = [ str(testContext[x]) for x in self.testVariables ]
-		self.in_test = True
+		# Count successful iterations
+		self.cur_iterations += 1
+		self.ok_iterations += 1
 
-		# Keep for summary
-		self.summaryLines.append(
-				"%i,%s" % ( self.testID, str(datetime.datetime.now()) )
-			)
+		# Keep the results
+		store = self.reporter.store
+		if store:
+			store.iteration( self.testID, iteration, cached['started'], cached['ended'], "Completed", "Cached", results )
 
-	def test_end( self, results, comment="" ):
+	def iteration_replay( self, iteration, started, ended, results, status="Completed", comment="" ):
 		"""
-		Log the end of a groupped test
+		Log an entire iteration that ran at the given times, without
+		printing its values
 		"""
 
-		# Write end and values
-		self.summaryLines[ len(self.summaryLines)-1 ] += \
-			",%s,%i,%i,%s,%s,%s\n" % ( str(datetime.datetime.now()), self.cur_iterations, self.ok_iterations, ",".join(self.activeTest), ",".join(results.render()), comment ) 
+		# Write the entire line
+		self.write("%i,%i of %i,%s,%s,%s,%s,%s,%s\n" % \
+			( self.testID, iteration, self.iterations, started, ended, status, ",".join(self.activeTest), ",".join(results.render()), comment ) )
+
+		# Count iterations
+		self.cur_iterations += 1
+		if status == "Completed":
+			self.ok_iterations += 1
 
+	def test_end( self, results, comment="", ended=None ):
+		"""
+		Log the end of a groupped test, optionally at the given time
+		"""
 		self.in_test = False
 
+		# Keep the previous summary if nothing was run for this test
+		if (self.cur_iterations == self.previousIterations) and (self.testID in self.reporter.previousSummary):
+			self.reporter.test_ended( self, "%s\n" % self.reporter.previousSummary[self.testID] )
+			return
+
+		# Write end and values
+		if ended is None:
+			ended = str(datetime.datetime.now())
+		self.reporter.test_ended( self, self.summary + \
+			",%s,%i,%i,%s,%s,%s\n" % ( ended, self.cur_iterations, self.ok_iterations, ",".join(self.activeTest), ",".join(results.render()), comment ) )
+		self.store_results( ended, comment, results )
+
+	def store_results( self, ended, comment, results ):
+		"""
+		Keep the summary and the raw results of the test in the store
+		"""
+		reporter = self.reporter
+		if reporter.store:
+			reporter.store.test( self.testID, list(zip(reporter.testVariables, self.activeTest)), self.testStarted, ended,
+				self.cur_iterations, self.ok_iterations, comment, results )
 
 	def interrupt(self, results, reason="Interrupted by the user"):
 		"""
 		User interrupted the test, log the action
 		"""
+		empty = ",".join( [""] * len(self.reporter.testTitles) )
 
 		# Finalize iterations
 		if self.in_iteration:
-			self.fd.write(",%s,%s,%s,%s,%s\n" % \
-				( str(datetime.datetime.now()), "Interrupted", ",".join(self.activeTest), ",".join( [""] * len(self.testTitles) ), reason ) )
+			ended = str(datetime.datetime.now())
+			self.write(",%s,%s,%s,%s,%s\n" % \
+				( ended, "Interrupted", ",".join(self.activeTest), empty, reason ) )
+			self.in_iteration = False
+			if self.reporter.store:
+				self.reporter.store.iteration( self.testID, self.iteration, self.started, ended, "Interrupted", reason, None )
 
 		# Finalize test
 		if self.in_test:
+			self.in_test = False
 			if not results:
-				self.fd.write(",%s,%s,%s,%s,%s\n" % \
-					( str(datetime.datetime.now()), "Interrupted", ",".join(self.activeTest), ",".join( [""] * len(self.testTitles) ), reason ) )
+				self.write(",%s,%s,%s,%s,%s\n" % \
+					( str(datetime.datetime.now()), "Interrupted", ",".join(self.activeTest), empty, reason ) )
+				self.reporter.test_ended( self, None )
 			else:
-				self.summaryLines[ len(self.summaryLines)-1 ] += \
-					",%s,%i,%i,%s,%s,%s\n" % ( str(datetime.datetime.now()), self.cur_iterations, self.ok_iterations, ",".join(self.activeTest), ",".join(results.render()), reason ) 
+				ended = str(datetime.datetime.now())
+				self.reporter.test_ended( self, self.summary + \
+					",%s,%i,%i,%s,%s,%s\n" % ( ended, self.cur_iterations, self.ok_iterations, ",".join(self.activeTest), ",".join(results.render()), reason ) )
+				self.store_results( ended, reason, results )
 
-		# Finalize
-		self.finalize()
+class ReportWriter(BufferedWriter):
+	"""
+	Appends text to a file from a background thread, in batches of whole
+	lines, so that a crash never leaves half-written lines behind. The
+	pending lines are written every 'report.flush' interval, following
+	the 'report.durability' (see BufferedWriter).
+	"""
+
+	def __init__(self, filename, mode="w", interval=1.0, durability="flush"):
+		"""
+		Open the given file for writing ('w') or appending ('a')
+		"""
+		BufferedWriter.__init__(self, filename, interval, durability)
+		self.logger = logging.getLogger("report")
+
+		# Open file in append mode, so every batch goes to the end
+		flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+		if mode == "w":
+			flags |= os.O_TRUNC
+		self.fd = os.open( filename, flags, 0o644 )
+
+		# Start the writer thread
+		self.start()
+
+	def write(self, text):
+		"""
+		Queue the given text for writing
+		"""
+		self.queue( text, len(text) )
+
+	def dump(self, pending):
+		"""
+		Write the whole lines among the given text
+		"""
+		text = "".join( pending )
+
+		# Keep the last incomplete line for the next batch,
+		# unless the file is closing
+		end = text.rfind("\n") + 1
+		if self.closing:
+			end = len(text)
+		if end < len(text):
+			self.requeue( text[end:] )
+		if end == 0:
+			return
+
+		# Write the batch, retrying partial writes
+		buf = text[0:end]
+		if not isinstance(buf, bytes):
+			buf = buf.encode("utf-8")
+		while buf:
+			buf = buf[ os.write(self.fd, buf): ]
+
+	def fileno(self):
+		"""
+		Return the descriptor of the file
+		"""
+		return self.fd
 
+	def release(self):
+		"""
+		Close the file
+		"""
+		os.close( self.fd )
+		self.fd = None
+
+class ReportFile(object):
+	"""
+	The sections of a report written by the Reporter
+	"""
+
+	def __init__(self, filename):
+		"""
+		Read and split the given report in sections
+		"""
+		self.filename = filename
+		self.notes = []
+		self.header = None
+		self.rows = []
+		self.summaryHeader = None
+		self.summary = []
+
+		# Read lines
+		with open(filename, "r") as f:
+			lines = f.read().split("\n")
+
+		# Split sections
+		section = self.notes
+		i = 0
+		while i < len(lines):
+			l = lines[i]
+			i += 1
+
+			# Check for section titles, followed by a blank line and the header
+			if l in ["Test numbers", "Summarized numbers"]:
+				if (i + 1 >= len(lines)) or lines[i]:
+					raise ValueError("Invalid report %s: Missing columns of '%s'" % (filename, l))
+				if l == "Test numbers":
+					self.header = lines[i+1]
+					section = self.rows
+				else:
+					self.summaryHeader = lines[i+1]
+					section = self.summary
+				i += 2
+				continue
+
+			# Skip blank lines between sections
+			if not l:
+				continue
+			section.append(l)
+
+		# Validate
+		if self.header is None:
+			raise ValueError("Invalid report %s: Missing test numbers" % filename)
+
+		# Drop the blank separator before the title
+		while self.notes and not self.notes[-1]:
+			self.notes.pop()
+
+	def fields(self, line):
+		"""
+		Split a line of the test numbers to its fields. Only the last
+		field (the comment) can contain commas.
+		"""
+		f = line.split(",", len(self.header.split(",")) - 1)
+		if len(f) < len(self.header.split(",")):
+			raise ValueError("Invalid report %s: Incomplete line '%s'" % (self.filename, line))
+		return f
+
+def _num( line ):
+	"""
+	Return the test number of a report line
+	"""
+	try:
+		return int(line.split(",", 1)[0])
+	except ValueError:
+		return 0
+
+def merge_reports( filename, sources ):
+	"""
+	Merge the given (shard) reports into a single report with the same
+	layout as the one written by the Reporter
+	"""
+	logger = logging.getLogger("report")
+	reports = [ ReportFile(f) for f in sources ]
+	if not reports:
+		raise ValueError("No reports to merge")
+
+	# Make sure all reports have the same columns
+	first = reports[0]
+	for r in reports[1:]:
+		if r.header != first.header:
+			raise ValueError("The columns of %s do not match the ones of %s" % (r.filename, first.filename))
+
+	# Collect notes from the first report, keeping the earliest start
+	notes = []
+	started = [ n for r in reports for n in r.notes if n.startswith("Started on,") ]
+	for n in first.notes:
+		if n.startswith("Started on,"):
+			n = min(started)
+		notes.append(n)
+
+	# Collect lines in test number order
+	rows = sorted([ l for r in reports for l in r.rows ], key=_num)
+	summary = sorted([ l for r in reports for l in r.summary ], key=_num)
+	summaryHeader = first.summaryHeader
+	if summaryHeader is None:
+		summaryHeader = "Num,Started,Ended,Iterations,Successful%s" % first.header[len("Num,Iteration,Started,Ended,Status"):]
+
+	# Write merged report
+	logger.info("Merging %i reports into %s" % (len(reports), filename))
+	with open(filename, "w") as f:
+		for n in notes:
+			f.write("%s\n" % n)
+		f.write("\n")
+		f.write("Test numbers\n")
+		f.write("\n")
+		f.write("%s\n" % first.header)
+		for l in rows:
+			f.write("%s\n" % l)
+		f.write("\n")
+		f.write("Summarized numbers\n")
+		f.write("\n")
+		f.write("%s\n" % summaryHeader)
+		for l in summary:
+			f.write("%s\n" % l)
+
+def reaggregate_series( specs, path, filename ):
+	"""
+	Aggregate again the metric series kept in the given directory,
+	using the metrics of the given specs, and write a new report
+	with the same layout as the one written by the Reporter
+	"""
+	logger = logging.getLogger("report")
+	reader = SeriesReader( path )
+	metrics = Metrics()
+	metrics.configure( specs.context )
+
+	# Group the iterations by test
+	tests = OrderedDict()
+	for num, iteration in sorted(reader.iterations()):
+		if not num in tests:
+			tests[num] = []
+		tests[num].append( iteration )
+
+	# Write a new report, without keeping the series again
+	logger.info("Aggregating %i iterations of %i tests from %s" % (len(reader), len(tests), path))
+	reporter = Reporter( filename, specs )
+	reporter.keepSeries = False
+	reporter.start()
+	for num, iterations in tests.items():
+		entries = [ reader.entries[(num, i)] for i in iterations ]
+		report = reporter.test_start( entries[0].get('variables', {}), max(iterations), num )
+		report.testStarted = entries[0].get('started', '')
+		report.summary = "%i,%s" % ( num, report.testStarted )
+
+		# Aggregate every iteration
+		results = []
+		for i, entry in zip(iterations, entries):
+			columns = reader.load( num, i )
+			r = MetricsResults()
+			for name, m in metrics.metrics.items():
+				if name in columns:
+					m.resetTime = columns[name].origin
+					r.updateFrom( m, columns[name] )
+				else:
+					r.updateFrom( m, m.createSeries() )
+
+			report.iteration_replay( i, entry.get('started', ''), entry.get('ended', ''), r,
+				entry.get('status', 'Completed'), entry.get('comment', '') )
+			if entry.get('status', 'Completed') == "Completed":
+				results.append( r )
+
+		# Summarize the test
+		report.test_end( summarize(results), "Aggregated again from %i iterations" % len(results), entries[-1].get('ended', '') )
+
+	# Finalize the report
+	reporter.finalize()
+	reporter.close()
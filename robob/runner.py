@@ -0,0 +1,658 @@
+
+import time
+import random
+import logging
+import threading
+
+from robob.util import time2sec
+from robob.stats import Convergence, _percent
+from robob.sweep import AdaptiveSweep
+from robob.context import MacroResolver
+
+class TestRunner(object):
+	"""
+	Runs all the iterations of a single test-case
+	"""
+
+	def __init__(self, specs, test, num, reporter, cache=None):
+		"""
+		Initialize the runner of the test with the given number
+		"""
+		self.specs = specs
+		self.test = test
+		self.num = num
+		self.reporter = reporter
+		self.cache = cache
+		self.report = None
+		self.results = None
+		self.driver = specs.createDriver( test )
+		self.logger = logging.getLogger("robob")
+
+		# Position of the test in this run, used for the progress
+		self.test_id = 0
+		self.tests = 1
+
+		# Iterations and their timing
+		self.iterations = 1
+		self.cooldown = 0
+		self.convergence = None
+		self.completed = {}
+		self.comment = ""
+		self.key = None
+		self.fresh = []
+		self.reused = []
+		self.ran = 0
+		self.elapsed = 0.0
+
+	def run(self):
+		"""
+		Run the test-case, reporting every iteration
+		"""
+		self.start()
+		for i in range( 0, self.iterations ):
+			self.iteration( i )
+			if self.converged():
+				break
+		self.finish()
+
+	def startReport(self, iterations=None):
+		"""
+		Start reporting the test-case, optionally overriding the maximum
+		number of iterations, and return its TestReport
+		"""
+		test = self.test
+
+		# Get some values from test specs
+		if iterations is None:
+			iterations = int(test.get("test.iterations", 1))
+		self.cooldown = time2sec(test.get("test.cooldown", 0))
+		if self.specs.replay:
+			self.cooldown = 0 # Replays run at full speed
+
+		# Check if we should stop iterating when results converge
+		if 'test.adaptive' in test:
+			self.convergence = Convergence( test['test.adaptive'], iterations )
+			iterations = self.convergence.max
+		self.iterations = iterations
+
+		# Start reporting the test
+		self.report = self.reporter.test_start( test, iterations, self.num+1 )
+		return self.report
+
+	def start(self, iterations=None):
+		"""
+		Start reporting the test-case, unless its report was already
+		started, and pick up the iterations that completed in a previous
+		run or that are cached
+		"""
+		test = self.test
+		driver = self.driver
+		report = self.report
+		if report is None:
+			report = self.startReport( iterations )
+		iterations = self.iterations
+
+		# Restore the iterations completed in a previous run
+		completed = report.completed()
+		driver.restore( list(completed.values()) )
+		self.completed = completed
+
+		# Reuse the cached iterations of the same test-case, running
+		# only the missing ones if there are not enough of them
+		convergence = self.convergence
+		if self.cache and not completed:
+			self.key = self.cache.key( test )
+			cached = (self.cache.load( self.key ) or [])[0:iterations]
+			if cached:
+				driver.restore( cached )
+				results = driver.results[ -len(cached): ]
+				for i, c in enumerate(cached):
+					report.iteration_cached( i+1, c, results[i] )
+					completed[i+1] = c['values']
+				self.reused = cached
+				if (len(cached) >= iterations) or (convergence and convergence.done( results )):
+					self.logger.info("Using %i cached iterations for test %i/%i" % (len(cached), self.test_id+1, self.tests))
+					self.comment = "Cached"
+				else:
+					self.logger.info("Using %i cached iterations for test %i/%i, running the rest" % (len(cached), self.test_id+1, self.tests))
+
+	def next(self):
+		"""
+		Return the next iteration that has not run yet, or None
+		"""
+		for i in range( 0, self.iterations ):
+			if not (i+1) in self.completed:
+				return i
+		return None
+
+	def iteration(self, i):
+		"""
+		Run the given iteration, unless it completed in a previous run
+		"""
+		if (i+1) in self.completed:
+			return
+		test = self.test
+		driver = self.driver
+		report = self.report
+		started = time.time()
+
+		# Calculate progress
+		p_total = (self.tests * self.iterations)
+		p_curr = self.test_id * self.iterations + i
+
+		# Start log
+		self.logger.info("Running %i/%i (test: %i/%i, iteration: %i/%i, values: {%s})" % (p_curr+1, p_total, self.test_id+1, self.tests, i+1, self.iterations, \
+			", ".join([ "%s=\"%s\"" % (k, str(v)) for k,v in test['curr'].items() ]) ))
+		report.iteration_start( i+1 )
+
+		# Run driver
+		driver.run(i)
+		report.iteration_end( driver.lastResults, driver.lastStatus, driver.lastComment )
+		if driver.lastStatus == "Completed":
+			self.fresh.append( report.lastIteration )
+		self.completed[i+1] = report.lastIteration['values']
+
+		# Apply cooldown
+		if self.cooldown:
+			self.logger.info("Waiting for %s sec before next test" % test.get("test.cooldown", "0"))
+			time.sleep(self.cooldown)
+
+		# Keep timing
+		self.ran += 1
+		self.elapsed += time.time() - started
+
+	def cost(self):
+		"""
+		Return the average wall-clock time of an iteration, or None
+		if no iteration was run
+		"""
+		if not self.ran:
+			return None
+		return self.elapsed / self.ran
+
+	def converged(self):
+		"""
+		Check if the results converged and no more iterations are needed
+		"""
+		convergence = self.convergence
+		if convergence and convergence.done( self.driver.results ):
+			if convergence.converged():
+				self.comment = "Converged after %i iterations (CI %.1f%%)" % (len(self.driver.results), convergence.width * 100)
+			else:
+				self.comment = "Not converged after %i iterations (CI %.1f%%)" % (len(self.driver.results), convergence.width * 100)
+			self.logger.info(self.comment)
+			return True
+		return False
+
+	def finish(self, comment=None):
+		"""
+		Summarize the iterations and finalize the test-case
+		"""
+		if not comment is None:
+			self.comment = comment
+
+		# Summarize iterations and finalize test, closing the
+		# output logs of the streams
+		self.results = self.driver.summarize()
+		self.report.test_end( self.results, self.comment )
+		self.driver.release()
+
+		# Keep the completed iterations in the cache
+		if self.key and self.fresh:
+			self.cache.store( self.key, self.reused + self.fresh )
+
+	def interrupt(self, reason="Interrupted by the user"):
+		"""
+		Interrupt the test-case, reporting the results so far
+		"""
+		self.driver.interrupt()
+		if self.report:
+			self.report.interrupt( self.driver.summarize(), reason )
+
+class TestScheduler(object):
+	"""
+	Runs the test-cases, placing as many of them as allowed to run
+	concurrently, as long as they don't use the same resources. The
+	resources of a test-case are the nodes of its streams and the
+	optional 'test.resources'. The test-cases are started in order.
+
+	  test:
+	    parallel: 8                 # Maximum number of concurrent test-cases
+	    resources: [ switch-1 ]     # Other resources used exclusively
+	    slots:                      # Optional node sets to place test-cases
+	      - { server: n1, client: n2 }
+	      - { server: n3, client: n4 }
+
+	  streams:
+	    - node: ${slot.server}
+	      app: server
+
+	"""
+
+	def __init__(self, specs, reporter, cache=None):
+		"""
+		Initialize the scheduler from the 'test' specs
+		"""
+		self.specs = specs
+		self.reporter = reporter
+		self.cache = cache
+		self.logger = logging.getLogger("scheduler")
+
+		self.parallel = int(specs.context.get("test.parallel", 1))
+		self.slots = list(specs.context.get("test.slots", []))
+		if self.parallel < 1:
+			self.parallel = 1
+
+		# Running test-cases and the resources and slots they use
+		self.runners = []
+		self.busy = set()
+		self.taken = set()
+		self.error = None
+		self.cond = threading.Condition()
+
+	def resources(self, test):
+		"""
+		Return the resources used by the given test context
+		"""
+		resolver = MacroResolver( test )
+		ans = set()
+		for s in self.specs.specs['streams']:
+			ans.add( "node:%s" % resolver.render(s['node']) )
+		extra = test.get("test.resources", [])
+		if isinstance(extra, str):
+			extra = [ extra ]
+		for r in extra:
+			ans.add( resolver.render(r) )
+		return ans
+
+	def place(self, test):
+		"""
+		Find a free slot for the given test context, and return the
+		(slot index, resources) or None if it cannot run right now
+		"""
+		if len(self.runners) >= self.parallel:
+			return None
+
+		# Without slots, the test-case uses fixed resources
+		if not self.slots:
+			res = self.resources(test)
+			if res & self.busy:
+				return None
+			return (None, res)
+
+		# Otherwise try all free slots, on a fork of the context so that
+		# only the slot that is picked is set on the test-case
+		for i, slot in enumerate(self.slots):
+			if i in self.taken:
+				continue
+			candidate = test.fork()
+			candidate.set( "slot", slot )
+			res = self.resources(candidate)
+			if not (res & self.busy):
+				test.set( "slot", slot )
+				return (i, res)
+		return None
+
+	def run(self, tests):
+		"""
+		Run all the test-cases of the given TestContexts
+		"""
+
+		for test_id, (num, test) in enumerate(tests.enumerate()):
+
+			# Create a test runner
+			runner = TestRunner( self.specs, test, num, self.reporter, self.cache )
+			runner.test_id = test_id
+			runner.tests = len(tests)
+
+			# Run sequentially in this thread
+			if self.parallel == 1:
+				if self.slots:
+					test.set( "slot", self.slots[0] )
+				self.runners = [ runner ]
+				runner.run()
+				self.runners = []
+				tests.completed( num, runner.results )
+				continue
+
+			# Wait until the test-case can be placed
+			with self.cond:
+				while True:
+					if self.error:
+						break
+					placed = self.place( test )
+					if placed:
+						break
+					self.cond.wait(0.1)
+				if self.error:
+					break
+
+				# Start the report here, so the tests are numbered
+				# and written in the order they are started
+				runner.startReport()
+
+				# Reserve resources
+				(slot, res) = placed
+				self.runners.append( runner )
+				self.busy |= res
+				if not slot is None:
+					self.taken.add( slot )
+
+			# Start a thread for the test-case
+			self.logger.debug("Starting test %i on %s" % (num+1, ", ".join(sorted(res))))
+			t = threading.Thread( target=self.runThread, args=(tests, runner, slot, res) )
+			t.daemon = True
+			t.start()
+
+		# Wait for all test-cases to complete
+		with self.cond:
+			while self.runners:
+				self.cond.wait(0.1)
+
+		# Raise the first error
+		if self.error:
+			raise self.error
+
+	def runThread(self, tests, runner, slot, res):
+		"""
+		Run the given test runner and release its resources
+		"""
+		try:
+			runner.run()
+		except Exception as e:
+			self.logger.error("Test %i failed: %s: %s" % (runner.num+1, e.__class__.__name__, str(e)))
+			if self.error is None:
+				self.error = e
+
+			# Close the report of the test, so the next ones can be written
+			if runner.report and not runner.report.ended:
+				runner.report.interrupt( runner.driver.summarize(), "%s: %s" % (e.__class__.__name__, str(e)) )
+		finally:
+			with self.cond:
+				self.runners.remove( runner )
+				self.busy -= res
+				if not slot is None:
+					self.taken.discard( slot )
+				self.cond.notify_all()
+			tests.completed( runner.num, runner.results )
+
+	def interrupt(self, reason="Interrupted by the user"):
+		"""
+		Interrupt all running test-cases
+		"""
+		for runner in list(self.runners):
+			runner.interrupt( reason )
+
+class InterleavedScheduler(object):
+	"""
+	Runs the test-cases one iteration at a time, alternating between
+	them, so that the drift of the environment over a long run (thermal
+	throttling, background daemons, network load) is spread over all
+	the test-cases instead of showing up as a trend between them.
+
+	  test:
+	    order: random       # 'sequential', 'round-robin' or 'random'
+	    seed: 1             # Seed of the random order
+
+	With 'round-robin' every round runs the next iteration of every
+	test-case in order, and with 'random' every round runs them in a
+	different random order. The test-cases run one by one in this
+	thread, so 'test.parallel' is not used.
+	"""
+
+	def __init__(self, specs, reporter, cache=None):
+		"""
+		Initialize the scheduler from the 'test' specs
+		"""
+		self.specs = specs
+		self.reporter = reporter
+		self.cache = cache
+		self.logger = logging.getLogger("scheduler")
+
+		self.order = str(specs.context.get("test.order", "round-robin"))
+		self.random = random.Random( specs.context.get("test.seed", None) )
+		if not self.order in [ "round-robin", "random" ]:
+			raise AssertionError("Unknown test order '%s'" % self.order)
+
+		# Started test-cases and the one running right now
+		self.runners = []
+		self.active = None
+
+	def createRunner(self, num, test, test_id, tests):
+		"""
+		Create and start the runner of the given test-case
+		"""
+		runner = TestRunner( self.specs, test, num, self.reporter, self.cache )
+		runner.test_id = test_id
+		runner.tests = tests
+		self.runners.append( runner )
+		runner.start()
+		return runner
+
+	def step(self, runner):
+		"""
+		Run the next iteration of the given runner
+		"""
+		self.active = runner
+		runner.iteration( runner.next() )
+		self.active = None
+
+		# The other test-cases run before the next iteration of this one,
+		# so release the buffers of its streams until then
+		runner.driver.release()
+
+	def run(self, tests):
+		"""
+		Run all the test-cases of the given TestContexts
+		"""
+		if isinstance(tests, AdaptiveSweep):
+			raise ValueError("Adaptive sweeps cannot be interleaved")
+		self.reporter.interleaved = True
+
+		# Run one iteration of every test-case in every round, starting
+		# the test-cases when they are first scheduled
+		count = len(tests)
+		runners = {}
+		pending = tests.numbers()
+		ids = dict([ (num, test_id) for test_id, num in enumerate(pending) ])
+		while pending:
+			if self.order == "random":
+				self.random.shuffle( pending )
+			for num in list(pending):
+				runner = runners.get( num )
+				if runner is None:
+					runner = self.createRunner( num, tests.createTestContext(num), ids[num], count )
+					runners[num] = runner
+
+					# Skip test-cases completed in a previous run or cached
+					if (runner.next() is None) or runner.converged():
+						pending.remove( num )
+						continue
+
+				# Run the next iteration, checking for convergence once
+				self.step( runner )
+				if (runner.next() is None) or runner.converged():
+					pending.remove( num )
+
+		# Summarize every test-case
+		self.finish( tests )
+
+	def finish(self, tests, comments={}):
+		"""
+		Finalize all the test-cases in order, with the given comments
+		"""
+		for runner in sorted(self.runners, key=lambda r: r.num):
+			runner.finish( comments.get(runner.num, None) )
+			tests.completed( runner.num, runner.results )
+
+	def interrupt(self, reason="Interrupted by the user"):
+		"""
+		Interrupt the running iteration and the started test-cases
+		"""
+		for runner in list(self.runners):
+			if runner is self.active:
+				runner.interrupt( reason )
+			elif runner.report and not runner.report.ended:
+				runner.report.interrupt( runner.driver.summarize(), reason )
+
+class BudgetScheduler(InterleavedScheduler):
+	"""
+	Runs the test-cases within a wall-clock budget. After a few pilot
+	iterations of every test-case that estimate their cost, the rest of
+	the budget is spent one iteration at a time on the test-case with the
+	widest confidence interval. If the pilot of the entire matrix does not
+	fit, a Latin-hypercube sample of the test-cases is run instead.
+
+	  test:
+	    iterations: 50          # Upper bound of iterations per test-case
+	    budget:
+	      time: 8h              # Total wall-clock budget
+	      pilot: 50%            # Maximum part of the budget for the pilot
+	      sample: true          # Sample the test-cases if they don't fit
+	      seed: 1               # Seed of the sample
+
+	The watched metrics, the minimum number of iterations and the
+	target CI are taken from 'test.adaptive', if defined.
+	"""
+
+	def __init__(self, specs, reporter, cache=None, budget=None):
+		"""
+		Initialize the scheduler from the 'test.budget' specs, optionally
+		overriding the time of the budget
+		"""
+		self.specs = specs
+		self.reporter = reporter
+		self.cache = cache
+		self.logger = logging.getLogger("budget")
+
+		config = specs.context.get("test.budget", {})
+		if not isinstance(config, dict):
+			config = { 'time': config }
+
+		self.time = None
+		self.pilot = 0.5
+		self.sample = True
+		self.seed = None
+
+		# Update optional
+		if 'time' in config:
+			self.time = time2sec(config['time'])
+		if 'pilot' in config:
+			self.pilot = _percent(config['pilot'])
+		if 'sample' in config:
+			self.sample = bool(config['sample'])
+		if 'seed' in config:
+			self.seed = config['seed']
+		if not budget is None:
+			self.time = time2sec(budget)
+
+		# Validate
+		if not self.time or (self.time <= 0):
+			raise AssertionError("The time of the budget must be positive")
+
+		# Started test-cases and the one running right now
+		self.runners = []
+		self.active = None
+		self.started = None
+
+	def remaining(self):
+		"""
+		Return the remaining time of the budget
+		"""
+		return self.time - (time.time() - self.started)
+
+	def policy(self, runner):
+		"""
+		Return the Convergence policy that measures the given runner
+		"""
+		if runner.convergence:
+			return runner.convergence
+		return Convergence( runner.test.get("test.adaptive", {}), runner.iterations )
+
+	def cost(self, runner):
+		"""
+		Return the estimated cost of an iteration of the given runner,
+		falling back to the average of the other runners
+		"""
+		cost = runner.cost()
+		if cost is None:
+			costs = [ r.cost() for r in self.runners if not r.cost() is None ]
+			if costs:
+				return sum(costs) / len(costs)
+			return 0.0
+		return cost
+
+	def startRunner(self, num, test, test_id, tests):
+		"""
+		Create and start the runner of the given test-case and run
+		its pilot iterations
+		"""
+		runner = self.createRunner( num, test, test_id, tests )
+
+		# Run the minimum number of iterations, that give a first CI
+		pilot = self.policy( runner ).min
+		while (len(runner.driver.results) < pilot) and (not runner.next() is None):
+			self.step( runner )
+		return runner
+
+	def run(self, tests):
+		"""
+		Run the test-cases of the given TestContexts within the budget
+		"""
+		if isinstance(tests, AdaptiveSweep):
+			raise ValueError("Adaptive sweeps cannot run within a budget")
+		self.started = time.time()
+		self.reporter.interleaved = True
+		count = len(tests)
+
+		# Run the pilot of the first test-case to estimate the cost
+		contexts = tests.enumerate()
+		for num, test in contexts:
+			first = self.startRunner( num, test, 0, count )
+			break
+		else:
+			return
+		pilot = self.time - self.remaining()
+
+		# Sample the test-cases if the pilot of all of them does not fit
+		if self.sample and (pilot * count > self.time * self.pilot):
+			size = max(1, int(self.time * self.pilot / max(pilot, 0.001)))
+			sampled = tests.sample( size, self.seed )
+			if not sampled is tests:
+				nums = [ n for n in sampled.indices if n != first.num ]
+				contexts = ( (n, tests.createTestContext(n)) for n in nums )
+				count = len(nums) + 1
+				self.logger.info("Sampled %i out of %i test-cases, that fit in the budget" % (count, len(tests)))
+		first.tests = count
+
+		# Run the pilot of the rest
+		for num, test in contexts:
+			if self.remaining() <= pilot:
+				self.logger.warn("Budget exhausted after the pilot of %i out of %i test-cases" % (len(self.runners), count))
+				break
+			self.startRunner( num, test, len(self.runners), count )
+
+		# Spend the rest of the budget on the widest intervals
+		while True:
+			remaining = self.remaining()
+			candidates = []
+			for runner in self.runners:
+				if runner.next() is None or (self.cost(runner) > remaining):
+					continue
+				policy = self.policy(runner)
+				if runner.convergence and policy.done( runner.driver.results ):
+					continue
+				candidates.append( (policy.widest( runner.driver.results ), runner) )
+			if not candidates:
+				break
+			width, runner = max(candidates, key=lambda c: c[0])
+			self.step( runner )
+
+		# Finalize all the test-cases, recording the allocation
+		comments = {}
+		for runner in sorted(self.runners, key=lambda r: r.num):
+			width = self.policy(runner).widest( runner.driver.results )
+			comments[runner.num] = "Budget of %i iterations at %.1f s/iteration (CI %.1f%%)" % \
+				( len(runner.driver.results), self.cost(runner), width * 100 )
+			self.logger.info("Test %i: %s" % (runner.num+1, comments[runner.num]))
+		self.finish( tests, comments )
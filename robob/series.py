@@ -0,0 +1,239 @@
+
+import os
+import sys
+import json
+import mmap
+import array
+import logging
+import threading
+
+from collections import OrderedDict
+from robob.metrics import MetricValue, MetricSeries, MetricColumns
+
+#: Name of the index in the series directory
+INDEX = "index.jsonl"
+
+def _frombytes( a, buf ):
+	"""
+	Fill the given array from a bytes buffer
+	"""
+	if hasattr(a, 'frombytes'):
+		a.frombytes( buf )
+	else:
+		a.fromstring( buf )
+	return a
+
+def _column( buf, offset, count, swap ):
+	"""
+	Return the float64 column of the given count at the given offset of
+	a memory map, as a view on the map, or as a copy if it has to be
+	swapped (or views can not be cast, ex. on python 2)
+	"""
+	if not count:
+		return array.array('d')
+	end = offset + count * 8
+	if not swap and hasattr(memoryview, 'cast'):
+		return memoryview( buf )[ offset:end ].cast('d')
+	a = _frombytes( array.array('d'), buf[ offset:end ] )
+	if swap:
+		a.byteswap()
+	return a
+
+def _number( v ):
+	"""
+	Return the value of a MetricValue as float, or NaN
+	"""
+	try:
+		n = v.number()
+		if n is None:
+			return float("nan")
+		return float(n)
+	except (TypeError, ValueError):
+		return float("nan")
+
+class SeriesArchive(object):
+	"""
+	Keeps the raw metric series of every iteration in a directory, in a
+	binary columnar layout. Every iteration is a file with, for every
+	metric, a column of timestamps (seconds since the reset of the metric,
+	from a monotonic clock) followed by a column of values, all native
+	float64 numbers. An index with one JSON line per iteration describes
+	the columns.
+
+	  report:
+	    keep_series: ./series
+
+	"""
+
+	def __init__(self, path):
+		"""
+		Open the series directory, creating it if missing
+		"""
+		self.path = path
+		self.lock = threading.Lock()
+		self.logger = logging.getLogger("series")
+
+		# Make directory
+		if not os.path.exists(self.path):
+			os.makedirs(self.path)
+		elif not os.path.isdir(self.path):
+			raise AssertionError("Directory %s is not directory!" % self.path)
+
+		# Open index, starting with a header
+		filename = os.path.join( self.path, INDEX )
+		exists = os.path.isfile( filename )
+		self.index = open( filename, "a" )
+		if not exists:
+			self.index.write( "%s\n" % json.dumps({ 'format': 'float64', 'byteorder': sys.byteorder, 'clock': 'monotonic' }) )
+			self.index.flush()
+		self.logger.info("Keeping the metric series in %s" % self.path)
+
+	def store(self, num, iteration, series, info={}):
+		"""
+		Write the given series (an OrderedDict of metric name to
+		MetricSeries) of an iteration, together with the given info
+		"""
+		filename = "%i-%i.f64" % (num, iteration)
+		columns = []
+
+		# Write the timestamp and value columns of every metric
+		offset = 0
+		with open( os.path.join(self.path, filename), "wb" ) as f:
+			for name, s in series.items():
+				points = list(s.points)
+				t = array.array( 'd', [ v.t - s.origin for v in points ] )
+				v = array.array( 'd', [ _number(x) for x in points ] )
+				t.tofile( f )
+				v.tofile( f )
+				columns.append( OrderedDict([
+					('metric', name), ('count', len(points)), ('origin', s.origin), ('dropped', s.dropped),
+					('t', offset), ('v', offset + len(points) * 8)
+				]) )
+				offset += len(points) * 16
+
+		# Append to the index
+		entry = OrderedDict([ ('num', num), ('iteration', iteration), ('file', filename) ])
+		entry.update( info )
+		entry['columns'] = columns
+		with self.lock:
+			self.index.write( "%s\n" % json.dumps(entry, default=str) )
+			self.index.flush()
+
+	def close(self):
+		"""
+		Close the index
+		"""
+		if self.index:
+			self.index.close()
+			self.index = None
+
+class SeriesReader(object):
+	"""
+	Loads the series kept by a SeriesArchive. The columns of an iteration
+	are read through a memory map, so only the parts that are used are
+	read from the disk.
+	"""
+
+	def __init__(self, path):
+		"""
+		Read the index of the given series directory
+		"""
+		self.path = path
+		self.header = {}
+		self.entries = OrderedDict()
+
+		# Read index, keeping the last entry of every iteration
+		with open( os.path.join(path, INDEX), "r" ) as f:
+			for i, l in enumerate(f):
+				l = l.strip()
+				if not l:
+					continue
+				try:
+					entry = json.loads( l )
+				except ValueError:
+					continue # Line of an interrupted write
+				if i == 0:
+					self.header = entry
+				else:
+					self.entries[ (entry['num'], entry['iteration']) ] = entry
+
+		# Validate
+		if self.header.get('format', None) != 'float64':
+			raise ValueError("Unknown format of series %s" % path)
+		self.swap = (self.header.get('byteorder', sys.byteorder) != sys.byteorder)
+
+	def __len__(self):
+		"""
+		Return the number of iterations
+		"""
+		return len(self.entries)
+
+	def iterations(self):
+		"""
+		Return the (test number, iteration) of every kept iteration
+		"""
+		return list(self.entries.keys())
+
+	def columns(self, num, iteration):
+		"""
+		Return an OrderedDict of metric name to the (timestamps, values)
+		columns of the given iteration. The columns are views on a memory
+		map of the file when possible, so their values are only read when
+		they are used.
+		"""
+		entry = self.entries[ (num, iteration) ]
+		ans = OrderedDict()
+
+		# Map the file and pick the columns. The map stays open as
+		# long as views on it are used.
+		with open( os.path.join(self.path, entry['file']), "rb" ) as f:
+			size = os.fstat( f.fileno() ).st_size
+			buf = None
+			if size:
+				buf = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+		for c in entry['columns']:
+			ans[ c['metric'] ] = (
+					_column( buf, c['t'], c['count'], self.swap ),
+					_column( buf, c['v'], c['count'], self.swap )
+				)
+
+		# Return columns
+		return ans
+
+	def load(self, num, iteration):
+		"""
+		Return an OrderedDict of metric name to the MetricColumns of the
+		given iteration, that can be aggregated without creating an
+		object for every value
+		"""
+		entry = self.entries[ (num, iteration) ]
+		info = dict([ (c['metric'], c) for c in entry['columns'] ])
+		ans = OrderedDict()
+		for name, (t, v) in self.columns( num, iteration ).items():
+			ans[name] = MetricColumns( t, v, info[name]['origin'], info[name]['dropped'] )
+		return ans
+
+	def series(self, num, iteration):
+		"""
+		Return an OrderedDict of metric name to the MetricSeries of the
+		given iteration, with the original timestamps. Values that were
+		dropped by the retention policy of a metric are not included
+		(see the 'dropped' count of the columns in the index). Prefer
+		load() for large series.
+		"""
+		entry = self.entries[ (num, iteration) ]
+		origins = dict([ (c['metric'], c) for c in entry['columns'] ])
+		ans = OrderedDict()
+
+		# Rebuild the values of every series
+		for name, (t, v) in self.columns( num, iteration ).items():
+			c = origins[name]
+			s = MetricSeries( t=c['origin'] )
+			for dt, n in zip(t, v):
+				x = MetricValue( n )
+				x.t = c['origin'] + dt
+				s.points.append( x )
+			ans[name] = s
+
+		# Return series
+		return ans
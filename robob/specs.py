@@ -2,6 +2,7 @@
 import re
 import os
 import yaml
+import random
 import itertools
 import datetime
 import logging
@@ -10,9 +11,14 @@ from collections import OrderedDict
 
 from robob.util import time2sec
 from robob.reporter import Reporter
+from robob.cache import ResultCache
+from robob.store import ResultStore
+from robob.sweep import AdaptiveSweep
 from robob.metrics import Metrics
 from robob.context import Context
 from robob.stream import Stream, streamContext
+from robob.driver import TestDriver, ReplayDriver
+from robob.expression import compile_expression, MissingVariable
 
 #: Macro regex
 RE_MACRO = re.compile(r'\$\{(.+?)\}')
@@ -59,6 +65,200 @@ def replace_robob_macros(m):
 	else:
 		raise AssertionError("Unknown robob macro '${%s}'" % key)
 
+def _unwrap( expr ):
+	"""
+	Strip the optional macro brackets around an expression
+	"""
+	expr = str(expr).strip()
+	if expr.startswith("${") and expr.endswith("}"):
+		return expr[2:-1]
+	return expr
+
+class TestContexts(object):
+	"""
+	The matrix of test contexts, created lazily as the product of
+	all the test-case values
+	"""
+
+	def __init__(self, specs, keys, values, indices=None, groups={}):
+		"""
+		Initialize the test-case matrix, optionally limited to the test-cases
+		with the given indices. The values of the keys in groups are tuples
+		with the values of the variables of the group.
+		"""
+		self.specs = specs
+		self.keys = keys
+		self.values = values
+		self.indices = indices
+		self.groups = groups
+
+	def __len__(self):
+		"""
+		Return the number of test-cases in the matrix
+		"""
+		if not self.indices is None:
+			return len(self.indices)
+		return self.total()
+
+	def __iter__(self):
+		"""
+		Create the test contexts one by one
+		"""
+		for i, ctx in self.enumerate():
+			yield ctx
+
+	def total(self):
+		"""
+		Return the number of test-cases in the entire matrix
+		"""
+		num = 1
+		for v in self.values:
+			num *= len(v)
+		return num
+
+	def enumerate(self):
+		"""
+		Create the test contexts one by one, together with their
+		index in the entire matrix
+		"""
+		if self.indices is None:
+			for i, v in enumerate(itertools.product(*self.values)):
+				yield (i, self.specs.createTestContext( self.variables(v) ))
+		else:
+			for i in self.indices:
+				yield (i, self.createTestContext(i))
+
+	def numbers(self):
+		"""
+		Return the numbers of the test-cases, without creating their contexts
+		"""
+		if self.indices is None:
+			return list(range(0, self.total()))
+		return list(self.indices)
+
+	def completed(self, num, results):
+		"""
+		Called with the summarized results of every completed test-case
+		"""
+		pass
+
+	def createTestContext(self, index):
+		"""
+		Create the test context of the test-case with the given index
+		"""
+
+		# Decode index, with the last key changing fastest
+		v = []
+		for values in reversed(self.values):
+			v.insert( 0, values[index % len(values)] )
+			index //= len(values)
+
+		# Create context
+		return self.specs.createTestContext( self.variables(v) )
+
+	def variables(self, values):
+		"""
+		Return the (variable, value) pairs of the given values of the
+		keys, expanding the values of the groups
+		"""
+		ans = []
+		for k, v in zip(self.keys, values):
+			if k in self.groups:
+				ans += list(zip( self.groups[k], v ))
+			else:
+				ans.append( (k, v) )
+		return ans
+
+	def where(self, include=[], exclude=[]):
+		"""
+		Return the test-cases for which all the include expressions are
+		true and none of the exclude expressions is
+		"""
+		include = [ compile_expression(_unwrap(e)) for e in include ]
+		exclude = [ compile_expression(_unwrap(e)) for e in exclude ]
+
+		# Evaluate the expressions in the context of every test-case
+		indices = []
+		for i, ctx in self.enumerate():
+			try:
+				if [ e for e in include if not e.evaluate(ctx) ]:
+					continue
+				if [ e for e in exclude if e.evaluate(ctx) ]:
+					continue
+			except MissingVariable as e:
+				raise AssertionError("Unknown variable '%s' in test-case constraints" % str(e))
+			indices.append(i)
+
+		# Return the test-cases that pass
+		return TestContexts( self.specs, self.keys, self.values, indices, self.groups )
+
+	def shard(self, index, count):
+		"""
+		Return the test-cases assigned to the given shard (0-based) out of
+		count shards. The test-cases are distributed deterministically,
+		balancing their estimated cost ('test.cost', or the number of
+		iterations if missing) with the longest-first heuristic.
+		"""
+		if (index < 0) or (index >= count):
+			raise ValueError("Shard %i is out of range 1-%i" % (index+1, count))
+
+		# Estimate the cost of every test-case
+		costs = []
+		for i, ctx in self.enumerate():
+			cost = ctx.get("test.cost", None)
+			if cost is None:
+				cost = ctx.get("test.iterations", 1)
+			costs.append( (-float(cost), i) )
+
+		# Assign the most expensive test-cases first to the least loaded shard
+		load = [ 0.0 ] * count
+		shards = [ [] for x in range(0, count) ]
+		for cost, i in sorted(costs):
+			s = load.index(min(load))
+			load[s] -= cost
+			shards[s].append(i)
+
+		# Return the test-cases of this shard in matrix order
+		return TestContexts( self.specs, self.keys, self.values, sorted(shards[index]), self.groups )
+
+	def sample(self, count, seed=None):
+		"""
+		Return a Latin-hypercube sample of count test-cases, spreading
+		the values of every dimension evenly over the sample. Test-cases
+		excluded by the constraints are replaced by other random ones.
+		"""
+		rng = random.Random(seed)
+		allowed = self.indices
+		if allowed is None:
+			allowed = range(0, self.total())
+		if count >= len(allowed):
+			return self
+		allowed = set(allowed)
+
+		# Split every dimension in count strata and shuffle their order
+		columns = []
+		for values in self.values:
+			strata = list(range(0, count))
+			rng.shuffle(strata)
+			columns.append([ int((s + rng.random()) * len(values) / count) for s in strata ])
+
+		# Combine the strata into test-case numbers
+		picked = set()
+		for k in range(0, count):
+			num = 0
+			for values, column in zip(self.values, columns):
+				num = num * len(values) + column[k]
+			if num in allowed:
+				picked.add(num)
+
+		# Fill the ones that collided or were not allowed
+		rest = sorted(allowed - picked)
+		rng.shuffle(rest)
+		picked |= set(rest[0:count - len(picked)])
+
+		# Return the test-cases of the sample in matrix order
+		return TestContexts( self.specs, self.keys, self.values, sorted(picked), self.groups )
+
 class Specs(object):
 	"""
 	Specifications file with nested specifications resolution support
@@ -72,13 +272,22 @@ class Specs(object):
 		self.filename = filename
 		self.specs = OrderedDict()
 
+		# Directory with the captured output to replay, if any
+		self.replay = None
+
 	def getTestVariables(self):
 		"""
 		Return the variable names of the test-cases
 		"""
 
-		# Return keys of test-cases
-		return list(self.specs['test-cases'].keys())
+		# Return keys of test-cases, and the variables of their groups
+		ans = []
+		for k,v in self.specs['test-cases'].items():
+			if isinstance(v, dict):
+				ans += list(v.keys())
+			else:
+				ans.append(k)
+		return ans
 
 	def getMetricTitles(self):
 		"""
@@ -95,43 +304,71 @@ class Specs(object):
 
 	def createTestContexts(self):
 		"""
-		Create test contexts according to specs
+		Create test contexts according to specs. The contexts are
+		created lazily, while iterating over the returned object.
 		"""
 
 		# Prepare product components
 		values = []
 		keys = []
+		groups = {}
 		for k,v in self.specs['test-cases'].items():
 			keys.append(k)
-			values.append(v)
 
-		# Generate test cases as product of combinations
-		contexts = []
-		for v in itertools.product(*values):
+			# Variables of groups are paired element by element
+			if isinstance(v, dict):
+				lengths = set([ len(x) for x in v.values() ])
+				if len(lengths) > 1:
+					raise AssertionError("The variables of the test-case group '%s' have different number of values" % k)
+				groups[k] = list(v.keys())
+				values.append( list(zip( *v.values() )) )
+			else:
+				values.append(v)
+
+		# Create the lazy test-case matrix, skipping combinations
+		# that don't satisfy the constraints
+		contexts = TestContexts( self, keys, values, groups=groups )
+		include = self.context.get( "test.include", [] )
+		exclude = self.context.get( "test.exclude", [] )
+		if isinstance(include, str):
+			include = [ include ]
+		if isinstance(exclude, str):
+			exclude = [ exclude ]
+		if include or exclude:
+			contexts = contexts.where( include, exclude )
+
+		# Return the test-cases, or an adaptive sweep over them
+		if 'test.sweep' in self.context:
+			return AdaptiveSweep( contexts, self.context['test.sweep'] )
+		return contexts
 
-			# Fork context
-			ctx = self.context.fork()
+	def createTestContext(self, values):
+		"""
+		Create the test context for the given test-case values
+		"""
 
-			# Update and collect
-			test_keys = dict(list(zip( keys, v)))
-			ctx.update( test_keys ) # Insert in global scope
-			ctx.set( "curr", test_keys ) # And in curr scope
-			contexts.append( ctx )
+		# Fork context
+		ctx = self.context.fork()
 
-		return contexts
+		# Update and collect
+		test_keys = OrderedDict(values)
+		ctx.update( test_keys ) # Insert in global scope
+		ctx.set( "curr", test_keys ) # And in curr scope
+		return ctx
 
 	def createStreams(self, testContext, testMetrics, iteration):
 		"""
-		Create a stream contexts using the specified test context as base
+		Create a stream contexts using the specified test context as base.
+		The streams have to be prepared with Stream.prepare() before every run.
 		"""
 		ans = []
 
-
 		# Create a stream object for every stream defined in specs
-		for specs in self.specs['streams']:
+		for i, specs in enumerate(self.specs['streams']):
 
-			# Create and configure a stream
-			stream = Stream( testContext, testMetrics, iteration )
+			# Create and configure a stream that updates
+			# its own metrics buffer
+			stream = Stream( testContext, testMetrics.buffer(i), iteration, i )
 			stream.configure( specs )
 
 			# Append to list
@@ -140,19 +377,49 @@ class Specs(object):
 		# Return streams
 		return ans
 
-	def createReporter(self):
+	def createDriver(self, testContext):
+		"""
+		Create the driver of the given test context, which replays the
+		captured output if a replay directory is defined
+		"""
+		if self.replay:
+			return ReplayDriver( self, testContext, self.replay )
+		return TestDriver( self, testContext )
+
+	def createReporter(self, shard=None):
 		"""
-		Create a reporter according to the specifications
+		Create a reporter according to the specifications. If shard is
+		given as an (index, count) tuple, the report is tagged with the shard.
 		"""
 
 		# Calculate filename
 		filename = self.context['report.path'] + "/"
 		filename += self.context['report.name']
 		filename += "-%s" % self.context['report.timestamp']
+		if shard:
+			filename += "-shard%iof%i" % (shard[0]+1, shard[1])
 		filename += ".csv"
 
 		# Create reporter
-		return Reporter( filename, self )
+		return Reporter( filename, self, self.createStore() )
+
+	def createCache(self):
+		"""
+		Create a result cache according to the specifications, or None
+		if there is no cache defined
+		"""
+		if not 'cache' in self.specs:
+			return None
+		return ResultCache( self, self.specs['cache'] )
+
+	def createStore(self):
+		"""
+		Create a result store according to the specifications, or None
+		if there is no store defined
+		"""
+		if not 'store' in self.specs:
+			return None
+		return ResultStore( self, self.specs['store'] )
 
 	def load(self):
 		"""
@@ -252,6 +519,10 @@ class Specs(object):
 		if 'report' in self.specs:
 			self.context.set("report", self.specs['report'])
 
+		# Import cache
+		if 'cache' in self.specs:
+			self.context.set("cache", self.specs['cache'])
+
 		# Initialize report defaults
 		if not 'report.name' in self.specs:
 			name = "test"
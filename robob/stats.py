@@ -0,0 +1,269 @@
+
+import math
+
+def mean( values ):
+	"""
+	Calculate the mean of the given values
+	"""
+	return float(sum(values)) / len(values)
+
+def stddev( values ):
+	"""
+	Calculate the sample standard deviation of the given values
+	"""
+	if len(values) < 2:
+		return 0.0
+	m = mean(values)
+	return math.sqrt( sum([ (v - m) ** 2 for v in values ]) / (len(values) - 1) )
+
+def norm_quantile( p ):
+	"""
+	Calculate the quantile of the standard normal distribution
+	"""
+
+	# Bisect on the cumulative distribution function
+	lo = -10.0
+	hi = 10.0
+	for i in range(0, 100):
+		mid = (lo + hi) / 2
+		if 0.5 * (1 + math.erf(mid / math.sqrt(2))) < p:
+			lo = mid
+		else:
+			hi = mid
+
+	# Return quantile
+	return (lo + hi) / 2
+
+def t_quantile( p, dof ):
+	"""
+	Calculate the quantile of the Student's t distribution with the given
+	degrees of freedom (exact for 1 and 2, Cornish-Fisher expansion otherwise)
+	"""
+
+	# Exact forms
+	if dof == 1:
+		return math.tan( math.pi * (p - 0.5) )
+	elif dof == 2:
+		return (2*p - 1) / math.sqrt( 2 * p * (1 - p) )
+
+	# Expand around the normal quantile
+	z = norm_quantile(p)
+	g1 = (z**3 + z) / 4
+	g2 = (5*z**5 + 16*z**3 + 3*z) / 96
+	g3 = (3*z**7 + 19*z**5 + 17*z**3 - 15*z) / 384
+	g4 = (79*z**9 + 776*z**7 + 1482*z**5 - 1920*z**3 - 945*z) / 92160
+	return z + g1/dof + g2/dof**2 + g3/dof**3 + g4/dof**4
+
+def ci_halfwidth( values, confidence=0.95 ):
+	"""
+	Calculate the half-width of the confidence interval of the mean
+	"""
+	n = len(values)
+	if n < 2:
+		return float("inf")
+	t = t_quantile( 1 - (1 - confidence) / 2, n - 1 )
+	return t * stddev(values) / math.sqrt(n)
+
+def relative_ci( values, confidence=0.95 ):
+	"""
+	Calculate the half-width of the confidence interval of the mean,
+	relative to the mean
+	"""
+	if len(values) < 2:
+		return float("inf")
+	m = abs(mean(values))
+	w = ci_halfwidth( values, confidence )
+	if m == 0:
+		if w == 0:
+			return 0.0
+		return float("inf")
+	return w / m
+
+class Convergence(object):
+	"""
+	Adaptive iteration policy that stops iterating a test-case when the
+	confidence intervals of the selected metrics are narrow enough.
+
+	  test:
+	    iterations: 20          # Upper bound of iterations
+	    adaptive:
+	      metrics: [ bandwidth ]  # Which metrics to watch (default all)
+	      ci: 0.05                # Target CI half-width, relative to mean
+	      confidence: 0.95        # Confidence level
+	      min: 3                  # Minimum number of iterations
+	      max: 20                 # Maximum number of iterations
+
+	"""
+
+	def __init__(self, config, iterations):
+		"""
+		Initialize the policy from the 'test.adaptive' config
+		"""
+
+		self.metrics = None
+		self.ci = 0.05
+		self.confidence = 0.95
+		self.min = 3
+		self.max = iterations
+
+		# Update optional
+		if 'metrics' in config:
+			self.metrics = config['metrics']
+			if isinstance(self.metrics, str):
+				self.metrics = [ self.metrics ]
+		if 'ci' in config:
+			self.ci = _percent(config['ci'])
+		if 'confidence' in config:
+			self.confidence = _percent(config['confidence'])
+		if 'min' in config:
+			self.min = int(config['min'])
+		if 'max' in config:
+			self.max = int(config['max'])
+
+		# Validate
+		if self.min < 2:
+			self.min = 2
+		if self.max < self.min:
+			self.max = self.min
+
+		# Last calculated relative CI
+		self.width = float("inf")
+
+	def widest(self, results):
+		"""
+		Return the widest relative confidence interval among the
+		values of the selected metrics in the given results
+		"""
+		if not results:
+			return float("inf")
+		widest = 0.0
+
+		# Check every value column of the watched metrics, skipping the
+		# columns that are not measured (ex. the steady window bounds)
+		first = results[0]
+		for i in range(0, len(first.values)):
+			if not getattr(first.metrics[i], 'measured', True):
+				continue
+			if not self.metrics is None and not first.metrics[i].name in self.metrics:
+				continue
+
+			# Collect values across iterations
+			values = [ r.values[i] for r in results if r.values[i] is not None ]
+			width = relative_ci( values, self.confidence )
+			if width > widest:
+				widest = width
+
+		# Return widest
+		return widest
+
+	def done(self, results):
+		"""
+		Check if no more iterations are required for the given results
+		"""
+		if len(results) < self.min:
+			return False
+		self.width = self.widest( results )
+		if len(results) >= self.max:
+			return True
+		return self.width <= self.ci
+
+	def converged(self):
+		"""
+		Check if the last check found the intervals converged
+		"""
+		return self.width <= self.ci
+
+class SteadyState(object):
+	"""
+	Steady-state detector that finds the part of a series where the
+	coefficient of variation over a moving window stays below a threshold,
+	trimming warm-up and cool-down samples.
+
+	  metrics:
+	    - name: bandwidth
+	      steady:
+	        window: 10      # Moving window size (samples)
+	        cv: 0.05        # Maximum stddev/mean within the window
+
+	"""
+
+	def __init__(self, config):
+		"""
+		Initialize detector from the 'steady' metric config
+		"""
+
+		self.window = 10
+		self.cv = 0.05
+
+		# Update optional
+		if not isinstance(config, dict):
+			config = {}
+		if 'window' in config:
+			self.window = int(config['window'])
+		if 'cv' in config:
+			self.cv = _percent(config['cv'])
+
+		# Validate
+		if self.window < 2:
+			self.window = 2
+
+	def detect(self, values):
+		"""
+		Return the (start, end) index range of the steady window of the
+		given numbers, which is the longest run of consecutive stable
+		windows, or None if no steady window is found (ex. if there
+		are fewer numbers than the window size).
+		"""
+		n = len(values)
+		w = self.window
+		if n < w:
+			return None
+
+		# Slide the window keeping running sums, and keep the longest
+		# run of consecutive stable windows
+		first = None
+		last = None
+		start = None
+		s = 0.0
+		sq = 0.0
+		for i in range(0, n):
+			v = float(values[i])
+			s += v
+			sq += v * v
+			if i >= w:
+				o = float(values[i - w])
+				s -= o
+				sq -= o * o
+			if i < w - 1:
+				continue
+
+			# Check the variation within the window
+			m = s / w
+			var = max( 0.0, (sq - s * s / w) / (w - 1) )
+			if m == 0:
+				stable = (var == 0)
+			else:
+				stable = math.sqrt(var) / abs(m) <= self.cv
+
+			# Expand the current run, or end it
+			if not stable:
+				start = None
+				continue
+			if start is None:
+				start = i - w + 1
+			if (first is None) or (i + 1 - start > last - first):
+				first = start
+				last = i + 1
+
+		# Return nothing if nothing was stable
+		if first is None:
+			return None
+		return (first, last)
+
+def _percent( value ):
+	"""
+	Parse a ratio given either as number or as percent string
+	"""
+	if isinstance(value, str) and value.endswith("%"):
+		return float(value[0:-1]) / 100
+	return float(value)
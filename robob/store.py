@@ -0,0 +1,179 @@
+
+import json
+import sqlite3
+import logging
+import datetime
+import threading
+
+from robob.metrics import Metrics
+from robob.expression import coerce
+
+#: Tables and indices of the database
+SCHEMA = [
+	"""CREATE TABLE IF NOT EXISTS runs (
+		id INTEGER PRIMARY KEY AUTOINCREMENT,
+		name TEXT, title TEXT, report TEXT, notes TEXT,
+		started TEXT, ended TEXT
+	)""",
+	"""CREATE TABLE IF NOT EXISTS tests (
+		run INTEGER, num INTEGER,
+		started TEXT, ended TEXT, iterations INTEGER, successful INTEGER, comment TEXT,
+		PRIMARY KEY (run, num)
+	)""",
+	"""CREATE TABLE IF NOT EXISTS variables (
+		run INTEGER, num INTEGER, name TEXT, value,
+		PRIMARY KEY (run, num, name)
+	)""",
+	"""CREATE TABLE IF NOT EXISTS iterations (
+		run INTEGER, num INTEGER, iteration INTEGER,
+		started TEXT, ended TEXT, status TEXT, comment TEXT,
+		PRIMARY KEY (run, num, iteration)
+	)""",
+	"""CREATE TABLE IF NOT EXISTS results (
+		run INTEGER, num INTEGER, iteration INTEGER, col INTEGER,
+		metric TEXT, title TEXT, value REAL, approx INTEGER,
+		PRIMARY KEY (run, num, iteration, col)
+	)""",
+	"CREATE INDEX IF NOT EXISTS variables_value ON variables (name, value, run, num)",
+	"CREATE INDEX IF NOT EXISTS results_metric ON results (metric, title, run)",
+	"CREATE INDEX IF NOT EXISTS runs_report ON runs (report)",
+]
+
+class ResultStore(object):
+	"""
+	A local SQLite database that keeps the raw (unformatted) results of
+	every run, together with the test-case variables, the status and the
+	timing of every iteration and the metadata of the run.
+
+	  store:
+	    path: ./results.db
+
+	The summarized values of a test are kept as iteration 0 in the
+	results table. For example, the 99th percentile of the latency of
+	the last 20 runs with size=65536:
+
+	  SELECT r.run, r.value FROM results r
+	    JOIN variables v ON (v.run = r.run AND v.num = r.num)
+	    WHERE v.name = 'size' AND v.value = 65536
+	      AND r.metric = 'latency' AND r.title LIKE '%p99%'
+	      AND r.iteration = 0
+	    ORDER BY r.run DESC LIMIT 20
+
+	"""
+
+	def __init__(self, specs, config):
+		"""
+		Initialize the store from the 'store' specs
+		"""
+		self.specs = specs
+		self.path = "./results.db"
+		self.logger = logging.getLogger("store")
+
+		# Update optional
+		if isinstance(config, dict):
+			if 'path' in config:
+				self.path = config['path']
+		elif config:
+			self.path = str(config)
+
+		# Metrics used to name and parse the values
+		self.metrics = Metrics()
+		self.metrics.configure( specs.context )
+		self.titles = self.metrics.titles()
+
+		# Open database
+		self.run = None
+		self.lock = threading.Lock()
+		self.db = sqlite3.connect( self.path, check_same_thread=False )
+		for s in SCHEMA:
+			self.db.execute( s )
+		self.db.commit()
+
+	def start(self, report, notes, resume=False):
+		"""
+		Start a new run that writes the given report, or continue
+		the last run of the report if resuming
+		"""
+		with self.lock:
+
+			# Find the run to continue
+			if resume:
+				row = self.db.execute( "SELECT MAX(id) FROM runs WHERE report = ?", (report,) ).fetchone()
+				if row and (row[0] is not None):
+					self.run = row[0]
+					self.db.execute( "UPDATE runs SET ended = NULL WHERE id = ?", (self.run,) )
+					self.db.commit()
+					self.logger.info("Continuing run %i in %s" % (self.run, self.path))
+					return
+
+			# Create a new run
+			c = self.db.execute( "INSERT INTO runs (name, title, report, notes, started) VALUES (?, ?, ?, ?, ?)", (
+				self.specs.specs.get('name', None), notes.get('Title', None), report,
+				json.dumps( notes, default=str ), str(datetime.datetime.now()) ) )
+			self.run = c.lastrowid
+			self.db.commit()
+			self.logger.info("Storing run %i in %s" % (self.run, self.path))
+
+	def parse(self, rendered):
+		"""
+		Parse the given rendered values back to results, or return
+		None if they cannot be parsed
+		"""
+		try:
+			return self.metrics.parse( rendered )
+		except ValueError:
+			return None
+
+	def values(self, num, iteration, results):
+		"""
+		Return the rows of the results table for the given results
+		"""
+		rows = []
+		if not results:
+			return rows
+		for i, (v, a, f) in enumerate(zip(results.values, results.approx, results.metrics)):
+			title = self.titles[i] if i < len(self.titles) else None
+			rows.append( (self.run, num, iteration, i, f.name, title, v, 1 if a else 0) )
+		return rows
+
+	def iteration(self, num, iteration, started, ended, status, comment, results):
+		"""
+		Keep an iteration of the given test and its results
+		"""
+		with self.lock:
+			self.db.execute( "INSERT OR REPLACE INTO iterations VALUES (?, ?, ?, ?, ?, ?, ?)",
+				(self.run, num, iteration, started, ended, status, comment) )
+			self.db.executemany( "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+				self.values( num, iteration, results ) )
+			self.db.commit()
+
+	def test(self, num, variables, started, ended, iterations, successful, comment, results):
+		"""
+		Keep the summary of the given test, its variables as (name, value)
+		pairs and its summarized results
+		"""
+		with self.lock:
+			self.db.execute( "INSERT OR REPLACE INTO tests VALUES (?, ?, ?, ?, ?, ?, ?)",
+				(self.run, num, started, ended, iterations, successful, comment) )
+			self.db.executemany( "INSERT OR REPLACE INTO variables VALUES (?, ?, ?, ?)",
+				[ (self.run, num, k, coerce(v)) for k, v in variables ] )
+			self.db.executemany( "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+				self.values( num, 0, results ) )
+			self.db.commit()
+
+	def finish(self):
+		"""
+		Mark the run as completed
+		"""
+		with self.lock:
+			self.db.execute( "UPDATE runs SET ended = ? WHERE id = ?", (str(datetime.datetime.now()), self.run) )
+			self.db.commit()
+
+	def close(self):
+		"""
+		Close the database
+		"""
+		with self.lock:
+			if self.db:
+				self.db.close()
+				self.db = None
@@ -4,11 +4,13 @@ import re
 import logging
 import random
 import string
+import threading
 
 from robob.util import time2sec
 from robob.factories import pipeFactory, parserFactory
 from robob.metrics import Metrics
-from robob.logpipe import LogPipe
+from robob.logpipe import LogPipe, log_extension
+from robob.context import MacroResolver
 from robob.pipe.bashwrap import Pipe as BashWrapPipe
 from robob.pipe.app import Pipe as AppPipe
 from robob.pipe.filegen import Pipe as FileGenPipe
@@ -21,15 +23,16 @@ def streamContext( context, specs ):
 
 	# Fork context
 	context = context.fork()
+	resolver = MacroResolver( context )
 
-	# Get node
-	node = specs['node']
+	# Get node, that can be chosen by macros (ex. '${slot.server}')
+	node = resolver.render( specs['node'] )
 	if not "node.%s" % node in context:
 		raise AssertionError("Node '%s' was not defined in the specs" % node)
 	node = context["node.%s" % node]
 
 	# Get app
-	app = specs['app']
+	app = resolver.render( specs['app'] )
 	if not "app.%s" % app in context:
 		raise AssertionError("App '%s' was not defined in the specs" % app)
 	app = context["app.%s" % app]
@@ -42,6 +45,12 @@ def streamContext( context, specs ):
 			raise AssertionError("env '%s' was not defined in the specs" % env)
 		env = context["env.%s" % env]
 
+	# The app file specs are updated below, so copy them
+	# instead of modifying the ones shared with the parent context
+	if 'files' in app:
+		app = dict(app)
+		app['files'] = [ dict(f) for f in app['files'] ]
+
 	########################################
 	# Initialize context variables
 	########################################
@@ -111,18 +120,32 @@ class Stream(object):
 
 	# Last stream ID
 	LAST_STREAM_ID = 0
+	LAST_STREAM_LOCK = threading.Lock()
 
-	def __init__(self, context, metrics, iteration):
+	def __init__(self, context, metrics, iteration, index=None):
 		"""
-		Initialize a new stream
+		Initialize a new stream, named after its index in the specs
+		if given, or otherwise after a global counter
 		"""
 
+		# Pick the ID, since streams can be created by many threads
+		if index is None:
+			with Stream.LAST_STREAM_LOCK:
+				index = Stream.LAST_STREAM_ID
+				Stream.LAST_STREAM_ID += 1
+
 		self.delay = 0
-		self.name = "stream_%i" % Stream.LAST_STREAM_ID
+		self.name = "stream_%i" % index
+		self.specs = None
+		self.base = context
+		self.temporary = False
+		self.fresh = False
 		self.pipe = None
 		self.bashPipe = None
 		self.appPipe = None
 		self.accessPipe = None
+		self.logPipe = None
+		self.logSource = None
 		self.metrics = metrics
 		self.context = context
 		self.timeout = None
@@ -133,12 +156,18 @@ class Stream(object):
 		# Open logger
 		self.logger = logging.getLogger("stream.%s" % self.name)
 
-		# Update last stream ID
-		Stream.LAST_STREAM_ID += 1
+	def logName(self):
+		"""
+		Return the name (without extension) of the file that holds the
+		output of the current iteration
+		"""
+		testval = "+".join([ "%s-%s" % (k, sanitize_fname(v)) for k,v in self.context['curr'].items() ])
+		return "out-%s-%s-%i" % (self.name, testval, self.iteration+1)
 
-	def openLogPipe(self):
+	def logFilename(self):
 		"""
-		Open a pipe to the filename that will hold the output of the application
+		Return the filename that will hold the output of the application
+		in the current iteration, or None if the output is not kept
 		"""
 
 		# If missing, return none
@@ -146,9 +175,9 @@ class Stream(object):
 			return None
 
 		# Calculate filename
-		testval = "+".join([ "%s-%s" % (k, sanitize_fname(v)) for k,v in self.context['curr'].items() ])
-		filename = "out-%s-%s-%i" % (self.name, testval, self.iteration+1)
-		filename += ".log"
+		format = str(self.context.get('report.output_format', 'plain'))
+		compression = str(self.context.get('report.output_compression', 'none'))
+		filename = self.logName() + log_extension( format, compression )
 
 		# Calculate directory name
 		basedir = self.context['report.keep_output'] + "/"
@@ -164,15 +193,31 @@ class Stream(object):
 		# Log
 		filename = "%s/%s" % (basedir, filename)
 		self.logger.info("Logging STDOUT to %s" % filename)
+		return filename
+
+	def openLogPipe(self, filename):
+		"""
+		Open a pipe to the given filename, that will hold the output of
+		the application
+		"""
+
+		# Get format of the log
+		format = str(self.context.get('report.output_format', 'plain'))
+		compression = str(self.context.get('report.output_compression', 'none'))
+		interval = time2sec(self.context.get('report.flush', 1))
+		durability = str(self.context.get('report.durability', 'flush'))
 
 		# Create and return a new logpipe
-		return LogPipe(filename)
+		return LogPipe(filename, format, compression, interval, durability)
 
 	def configure(self, specs):
 		"""
 		Configure stream from the specified specs context
 		"""
 
+		self.specs = specs
+		self.fresh = True
+
 		# Get simple properties
 		self.delay = 0
 		if 'delay' in specs:
@@ -186,7 +231,7 @@ class Stream(object):
 			self.logger = logging.getLogger("stream.%s" % self.name)
 
 		# Initialize context
-		self.context = streamContext( self.context, specs )
+		self.context = streamContext( self.base, specs )
 
 		# Check if stream is active
 		if 'stream.active' in self.context:
@@ -203,6 +248,7 @@ class Stream(object):
 		########################################
 
 		# Factory app pipe
+		self.accessPipe = None
 		self.appPipe = AppPipe( self.context )
 		self.appPipe.configure( self.context['app'] )
 
@@ -210,11 +256,6 @@ class Stream(object):
 		self.bashPipe = BashWrapPipe( self.context )
 		self.bashPipe.plug( self.appPipe )
 
-		# Factory log pipe to capture output
-		out = self.openLogPipe()
-		if out:
-			self.appPipe.listen( out )
-
 		########################################
 		# Initialize file generators
 		########################################
@@ -232,6 +273,7 @@ class Stream(object):
 
 				# If this is temporary, add cleanup pipe
 				if filegen['temp']:
+					self.temporary = True
 
 					# Instantiate and configure file delete pipe
 					dpipe = FileDelPipe( self.context )
@@ -373,4 +415,59 @@ class Stream(object):
 		# That's now our master pipe and we are ready to go!
 		self.pipe = self.accessPipe
 
+	def prepare(self, iteration):
+		"""
+		Prepare the configured stream for running the given iteration.
 
+		The rendered context and the pipe/parser topology are kept across
+		iterations, so only the output log is re-opened and the pipe and
+		parser states are reset. Streams with temporary files are
+		configured again instead, to render new random paths.
+		"""
+		self.iteration = iteration
+
+		# Nothing to prepare on inactive streams
+		if not self.active:
+			return
+
+		# Stop capturing the pipes of the previous iteration
+		if self.logPipe:
+			self.logSource.unlisten( self.logPipe )
+
+		# Temporary files get new paths in every iteration
+		if self.temporary and not self.fresh:
+			self.configure( self.specs )
+		self.fresh = False
+
+		# Capture the output in the log of this iteration, re-using the
+		# log pipe (and its writer) of the previous iterations. The plain
+		# logs keep the output of the application, and the framed logs
+		# the multiplexed output of the application and the streamlets,
+		# so that both can be replayed.
+		filename = self.logFilename()
+		if filename:
+			if self.logPipe:
+				self.logPipe.open( filename )
+			else:
+				self.logPipe = self.openLogPipe( filename )
+			self.logSource = self.appPipe
+			if self.logPipe.framed():
+				self.logSource = self.bashPipe
+			self.logSource.listen( self.logPipe )
+
+		# Reset pipes and parsers
+		self.pipe.pipe_reset()
+
+	def release(self):
+		"""
+		Close the output log and drop the state of the pipes and parsers,
+		keeping the rendered context and the topology for the next time
+		the stream is prepared
+		"""
+		if not self.active:
+			return
+		if self.logPipe:
+			self.logSource.unlisten( self.logPipe )
+			self.logPipe.close()
+			self.logPipe = None
+		self.pipe.pipe_reset()
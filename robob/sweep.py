@@ -0,0 +1,234 @@
+
+import logging
+import itertools
+import threading
+
+from robob.stats import _percent
+
+class AdaptiveSweep(object):
+	"""
+	An adaptive sweep over the values of one test-case dimension. Instead
+	of running every value, it starts from a coarse grid and then keeps
+	bisecting the intervals where the watched metric changes the most,
+	separately for every combination of the other dimensions.
+
+	  test:
+	    sweep:
+	      dimension: size     # Test-case dimension to refine
+	      metric: average     # Metric to watch (default the first one)
+	      initial: 5          # Number of values in the coarse grid
+	      resolution: 5%      # Don't split intervals that change less
+	      budget: 8           # Maximum number of values to run
+
+	The values are always picked among the ones listed in the test-cases
+	that satisfy the test-case constraints, so the test numbers are the
+	same as the ones of the full matrix.
+	"""
+
+	def __init__(self, contexts, config):
+		"""
+		Initialize the sweep over the given TestContexts matrix
+		"""
+		self.contexts = contexts
+		self.logger = logging.getLogger("sweep")
+
+		# Dimension to refine
+		self.dimension = config['dimension']
+		if not self.dimension in contexts.keys:
+			raise AssertionError("Sweep dimension '%s' is not a test-case" % self.dimension)
+		self.dim = contexts.keys.index( self.dimension )
+		size = len(contexts.values[self.dim])
+
+		self.metric = None
+		self.initial = min(5, size)
+		self.resolution = 0.05
+		self.budget = size
+
+		# Update optional
+		if 'metric' in config:
+			self.metric = config['metric']
+		if 'initial' in config:
+			self.initial = int(config['initial'])
+		if 'resolution' in config:
+			self.resolution = _percent(config['resolution'])
+		if 'budget' in config:
+			self.budget = int(config['budget'])
+
+		# Validate
+		self.initial = max(2, min(self.initial, size))
+		self.budget = max(self.initial, min(self.budget, size))
+
+		# Watched values of the completed test-cases, by test number
+		self.results = {}
+		self.cond = threading.Condition()
+
+	def __len__(self):
+		"""
+		Return the maximum number of test-cases of the sweep
+		"""
+		return sum([ min(self.budget, len(candidates)) for combo, candidates in self.candidates() ])
+
+	def __iter__(self):
+		"""
+		Create the test contexts one by one
+		"""
+		for i, ctx in self.enumerate():
+			yield ctx
+
+	def total(self):
+		"""
+		Return the number of test-cases in the entire matrix
+		"""
+		return self.contexts.total()
+
+	def shard(self, index, count):
+		"""
+		Adaptive sweeps depend on their own results, so they cannot be sharded
+		"""
+		raise ValueError("Adaptive sweeps cannot be sharded")
+
+	def number(self, indices):
+		"""
+		Return the test number of the given value indices
+		"""
+		num = 0
+		for i, values in zip(indices, self.contexts.values):
+			num = num * len(values) + i
+		return num
+
+	def candidates(self):
+		"""
+		Return the indices of the values of the swept dimension that can run,
+		for every combination of the other dimensions
+		"""
+		values = self.contexts.values
+		others = [ range(0, len(v)) for v in values ]
+		others[self.dim] = [ 0 ]
+
+		# Collect the indices allowed by the constraints
+		allowed = self.contexts.indices
+		if not allowed is None:
+			allowed = set(allowed)
+		ans = []
+		for combo in itertools.product(*others):
+			candidates = []
+			for i in range(0, len(values[self.dim])):
+				idx = list(combo)
+				idx[self.dim] = i
+				if (allowed is None) or (self.number(idx) in allowed):
+					candidates.append(i)
+			ans.append( (combo, candidates) )
+		return ans
+
+	def completed(self, num, results):
+		"""
+		Keep the watched value of the completed test-case
+		"""
+		value = None
+		if results and results.values:
+			for i in range(0, len(results.values)):
+				if (self.metric is None) or (results.metrics[i].name == self.metric):
+					value = results.values[i]
+					break
+
+		# Wake up the sweep
+		with self.cond:
+			self.results[num] = value
+			self.cond.notify_all()
+
+	def wait(self, nums):
+		"""
+		Wait until the test-cases with the given numbers have completed
+		"""
+		with self.cond:
+			while [ n for n in nums if not n in self.results ]:
+				self.cond.wait(0.1)
+
+	def refine(self, points):
+		"""
+		Return the position of the value to run next, given the (position,
+		value) points run so far, or None if the sweep is complete
+		"""
+		if len(points) >= self.budget:
+			return None
+
+		# Compare the change of every interval to the range of the values
+		measured = [ v for i, v in points if not v is None ]
+		if not measured:
+			return None
+		scale = max([ abs(v) for v in measured ])
+
+		# Find the interval that changes the most and can be split
+		best = None
+		for (a, va), (b, vb) in zip(points[0:-1], points[1:]):
+			if (b - a < 2) or (va is None) or (vb is None):
+				continue
+			if scale == 0:
+				change = 0.0
+			else:
+				change = abs(vb - va) / float(scale)
+			if change < self.resolution:
+				continue
+			if (best is None) or (change > best[0]):
+				best = (change, (a + b) // 2)
+
+		# Return the middle of the interval
+		if best is None:
+			return None
+		return best[1]
+
+	def enumerate(self):
+		"""
+		Create the test contexts one by one, together with their
+		test number, running the refinements when the results of the
+		previous ones are available
+		"""
+
+		# Start with the coarse grid for every combination of the other
+		# dimensions, picking positions among the values that can run
+		runs = []
+		for combo, candidates in self.candidates():
+			size = len(candidates)
+			if not size:
+				continue
+			initial = min(self.initial, size)
+			grid = [ 0 ]
+			if initial > 1:
+				grid = sorted(set([ int(round(k * (size - 1) / float(initial - 1))) for k in range(0, initial) ]))
+			run = []
+			for p in grid:
+				idx = list(combo)
+				idx[self.dim] = candidates[p]
+				run.append( (p, self.number(idx)) )
+			runs.append( (combo, candidates, run) )
+
+		# Run the coarse grid
+		pending = []
+		for combo, candidates, run in runs:
+			for p, num in run:
+				pending.append( num )
+				yield (num, self.contexts.createTestContext(num))
+
+		# Keep refining until all combinations are complete
+		while pending:
+			self.wait( pending )
+			pending = []
+			for combo, candidates, run in runs:
+
+				# Pick the next value of this combination
+				points = sorted([ (p, self.results[num]) for p, num in run ])
+				p = self.refine( points )
+				if p is None:
+					continue
+
+				# Run it
+				idx = list(combo)
+				idx[self.dim] = candidates[p]
+				num = self.number(idx)
+				run.append( (p, num) )
+				pending.append( num )
+				self.logger.info("Refining %s at %s" % (self.dimension, str(self.contexts.values[self.dim][candidates[p]])))
+				yield (num, self.contexts.createTestContext(num))
+
+		# Log the points that were run
+		self.logger.info("Sweep completed after %i test-cases" % sum([ len(run) for combo, candidates, run in runs ]))
@@ -1,4 +1,19 @@
 
+import time
+
+#: Monotonic clock, where available
+monotonic = getattr(time, 'monotonic', time.time)
+
+#: Offset of the monotonic clock from the wall-clock time at startup
+_EPOCH = time.time() - monotonic()
+
+def monotime():
+	"""
+	Return the time of a monotonic clock, in seconds since the epoch
+	(aligned to the wall-clock time when robob started)
+	"""
+	return _EPOCH + monotonic()
+
 def time2sec(timestr):
 	"""
 	Conver time specs to seconds
@@ -0,0 +1,169 @@
+
+import os
+import logging
+import threading
+
+class BufferedWriter(object):
+	"""
+	Base of the writers that queue items and write them to a file in
+	batches from a background thread, so that the tests don't wait for
+	slow (ex. network) file systems.
+
+	  report:
+	    flush: 1s             # How often to write the pending items
+	    durability: flush     # 'none', 'flush' or 'fsync'
+
+	With 'flush' the pending items are handed to the operating system
+	every interval, with 'fsync' they are also synced to the disk, and
+	with 'none' they are kept in memory until there are enough of them.
+	An interval of 0 writes every item right away.
+
+	The subclasses open their file, call start() and implement dump(),
+	fileno() and release().
+	"""
+
+	#: How many bytes of items to keep in memory before writing them
+	BUFFER_SIZE = 65536
+
+	#: How many bytes of items to queue before waiting for the writer,
+	#: or 0 to never wait
+	MAX_PENDING = 0
+
+	def __init__(self, filename, interval=1.0, durability="flush"):
+		"""
+		Initialize a writer to the given file
+		"""
+		if not durability in [ "none", "flush", "fsync" ]:
+			raise AssertionError("Unknown report durability '%s'" % durability)
+		self.filename = filename
+		self.interval = interval
+		self.durability = durability
+		self.logger = logging.getLogger("writer")
+
+		# Items not written yet
+		self.pending = []
+		self.size = 0
+		self.error = None
+		self.closing = False
+		self.cond = threading.Condition()
+		self.lock = threading.Lock()
+		self.thread = None
+
+	def start(self):
+		"""
+		Start the writer thread, once the file is open
+		"""
+		if self.interval > 0:
+			self.thread = threading.Thread( target=self.run )
+			self.thread.daemon = True
+			self.thread.start()
+
+	def queue(self, item, size):
+		"""
+		Queue the given item of the given size in bytes for writing,
+		waiting if the writer is too far behind
+		"""
+		with self.cond:
+			if self.error:
+				raise self.error
+			while self.thread and self.MAX_PENDING and (self.size > self.MAX_PENDING) and not self.error:
+				self.cond.wait( 0.1 )
+			self.pending.append( item )
+			self.size += size
+			if self.size >= self.BUFFER_SIZE:
+				self.cond.notify_all()
+		if self.thread is None:
+			self.commit( self.durability != "none" )
+
+	def requeue(self, item):
+		"""
+		Put back the given item in front of the pending ones, without
+		counting it, so that it is written with the next batch
+		"""
+		with self.cond:
+			self.pending.insert( 0, item )
+
+	def run(self):
+		"""
+		Write the pending items every interval until closed
+		"""
+		while True:
+			with self.cond:
+				if not self.closing and (self.size < self.BUFFER_SIZE):
+					self.cond.wait( self.interval )
+				closing = self.closing
+			try:
+				self.commit( closing or (self.durability != "none") )
+			except (IOError, OSError) as e:
+				self.logger.error("Unable to write %s: %s" % (self.filename, str(e)))
+				with self.cond:
+					self.error = e
+					self.cond.notify_all()
+				return
+			if closing:
+				return
+
+	def commit(self, force=True):
+		"""
+		Write the pending items. Unless forced, the items are written
+		only when there are enough of them.
+		"""
+		with self.lock:
+			with self.cond:
+				if not force and (self.size < self.BUFFER_SIZE):
+					return
+				pending = self.pending
+				self.pending = []
+				self.size = 0
+				self.cond.notify_all()
+			if not pending:
+				return
+
+			# Hand them to the operating system
+			self.dump( pending )
+			if self.durability == "fsync":
+				os.fsync( self.fileno() )
+
+	def flush(self):
+		"""
+		Write all the items queued so far
+		"""
+		with self.cond:
+			if self.error:
+				raise self.error
+		self.commit()
+
+	def close(self):
+		"""
+		Write everything that is pending and close the file
+		"""
+		with self.cond:
+			if self.closing:
+				return
+			self.closing = True
+			self.cond.notify_all()
+		if self.thread:
+			self.thread.join()
+		else:
+			self.commit()
+		self.release()
+		if self.error:
+			raise self.error
+
+	def dump(self, items):
+		"""
+		Write the given items to the file (implemented by the subclasses)
+		"""
+		raise NotImplementedError("The writer does not implement dump()")
+
+	def fileno(self):
+		"""
+		Return the file descriptor to sync (implemented by the subclasses)
+		"""
+		raise NotImplementedError("The writer does not implement fileno()")
+
+	def release(self):
+		"""
+		Close the file (implemented by the subclasses)
+		"""
+		raise NotImplementedError("The writer does not implement release()")